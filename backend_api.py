@@ -1,90 +1,97 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import base64
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import io
 import os
-from PIL import Image
 import cv2
-try:
-    import torch
-except Exception:
-    torch = None
-try:
-    import easyocr
-except Exception:
-    easyocr = None
-try:
-    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-except Exception:
-    TrOCRProcessor = None
-    VisionEncoderDecoderModel = None
-from openai import OpenAI
-import tempfile
-from math_checker import SimpleMathChecker
+import numpy as np
+from math_checker import SimpleMathChecker, get_result_cache, get_openai_client, get_client_registry
+from trocr_reader import TrOCRReader, TROCR_MODEL_NAME, TROCR_BACKEND, load_trocr_onnx, trocr_model_bytes
+from ocr_cascade import OCRCascade
+from model_manager import ModelManager, torch_module_bytes
+from worksheet_index import FixedWorksheetIndex
+from image_store import AnnotatedImageStore, IMAGE_FORMATS, parse_range
+from signaling import SignalingHub
+from signal_broker import make_broker
+from live_grading import LiveGrader
+from rag_index import RAG_TOP_K
+from rag_store import RagStoreManager
+from uploads import (UploadLimitMiddleware, check_upload_type, read_upload,
+                     IMAGE_TYPES, ZIP_TYPES, UPLOAD_FORM_OVERHEAD_BYTES, UPLOAD_MAX_BYTES)
 import re
 import json
-import math
 from functools import lru_cache
 import threading
 import uuid
+import asyncio
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 app = FastAPI(title="Miila Math Checker API", version="1.0.0")
 # -------------------------------
 # Simple WebSocket signaling for WebRTC (POC)
 # -------------------------------
-_room_lock = threading.Lock()
-_room_to_clients: dict[str, set] = {}
+# Per-peer bounded queues + writer tasks: relay never awaits a slow subscriber.
+# MIILA_SIGNAL_BROKER=redis://... or unix://... shares rooms across uvicorn workers.
+_signaling_hub = SignalingHub(broker=make_broker())
+
+@app.on_event("startup")
+async def _start_signaling_hub():
+    await _signaling_hub.start()
+
+@app.on_event("shutdown")
+async def _stop_signaling_hub():
+    await _signaling_hub.stop()
 
 @app.websocket("/ws/signal")
 async def ws_signal(websocket: WebSocket, room: str = Query(..., min_length=1), role: str | None = Query(None)):
     # Accept connection
     await websocket.accept()
+    client = _signaling_hub.join(websocket, room, role)
     try:
-        with _room_lock:
-            clients = _room_to_clients.get(room)
-            if clients is None:
-                clients = set()
-                _room_to_clients[room] = clients
-            clients.add(websocket)
-        # Relay any incoming text messages to other peers in the same room
+        # Relay any incoming text messages to other peers in the same room (heartbeat pongs stay here)
         while True:
             msg = await websocket.receive_text()
-            # Broadcast to all other clients in the room
-            with _room_lock:
-                targets = list(_room_to_clients.get(room, set()))
-            for ws in targets:
-                if ws is websocket:
-                    continue
-                try:
-                    await ws.send_text(msg)
-                except Exception:
-                    # Drop broken connections
-                    try:
-                        with _room_lock:
-                            _room_to_clients.get(room, set()).discard(ws)
-                    except Exception:
-                        pass
+            _signaling_hub.receive(client, msg)
     except WebSocketDisconnect:
         pass
     except Exception:
         # swallow other errors to keep server healthy
         pass
     finally:
-        try:
-            with _room_lock:
-                group = _room_to_clients.get(room)
-                if group is not None:
-                    group.discard(websocket)
-                    if not group:
-                        _room_to_clients.pop(room, None)
-        except Exception:
-            pass
+        await _signaling_hub.leave(client)
+
+@app.get("/ws/stats")
+async def signaling_stats():
+    """Rooms, peers and relay/backpressure counters of the signaling hub"""
+    return _signaling_hub.stats()
 
 # Fixed worksheet configuration (always process the same image if enabled)
 FIXED_WORKSHEET_DIR = os.path.join(os.path.dirname(__file__), "uploads", "fixed")
 FIXED_WORKSHEET_FILE = os.getenv("MIILA_FIXED_WORKSHEET_FILE")  # filename or absolute path
 ALWAYS_USE_FIXED = os.getenv("MIILA_ALWAYS_USE_FIXED", "0").lower() in ("1", "true", "yes")
+# Polled in the background; requests only read the in-memory snapshot
+_fixed_index = FixedWorksheetIndex(FIXED_WORKSHEET_DIR, fixed_file=FIXED_WORKSHEET_FILE, pin_first=ALWAYS_USE_FIXED)
+
+@app.on_event("startup")
+def _start_fixed_index():
+    _fixed_index.start()
+
+@app.on_event("shutdown")
+def _stop_fixed_index():
+    _fixed_index.stop()
+
+@app.get("/fixed/stats")
+async def fixed_stats():
+    """Which pre-uploaded worksheet requests are graded against"""
+    return _fixed_index.stats()
+
+# Oversize bodies are refused from Content-Length, or while streaming when there is none,
+# before the multipart parser buffers or spools them; handlers then read uploads into memory.
+# Added before CORS so CORS (outermost) still decorates the 413
+BATCH_UPLOAD_MAX_BYTES = int(float(os.getenv("MIILA_BATCH_UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+app.add_middleware(UploadLimitMiddleware, path_limits={"/batch/": BATCH_UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES})
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -111,98 +118,279 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "miila-math-checker"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the worksheet result cache"""
+    return get_result_cache().stats()
+
+# -------------------------------
+# Bounded grading executor
+# -------------------------------
+# check_worksheet blocks on the GPT-4o round trip and on cv2 work, so it runs on
+# a dedicated thread pool instead of the event loop. Requests beyond
+# workers + queue depth are rejected with 503 rather than piling up.
+GRADING_WORKERS = max(1, int(os.getenv("MIILA_GRADING_WORKERS", "4")))
+GRADING_QUEUE_DEPTH = max(0, int(os.getenv("MIILA_GRADING_QUEUE_DEPTH", "16")))
+_grading_executor = ThreadPoolExecutor(max_workers=GRADING_WORKERS, thread_name_prefix="miila-grader")
+_grading_slots = threading.BoundedSemaphore(GRADING_WORKERS + GRADING_QUEUE_DEPTH)
+# "vision": GPT-4o reads the page; "offline": TrOCR reads the answer boxes, GPT-4o only for uncertain crops
+GRADING_MODE = os.getenv("MIILA_GRADING_MODE", "vision").lower()
+
+async def _run_grading(fn, *args):
+    """Run a blocking grading call on the grading executor without stalling the event loop."""
+    if not _grading_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Grading queue is full, please retry shortly")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_grading_executor, fn, *args)
+    finally:
+        _grading_slots.release()
+
+@app.on_event("shutdown")
+def _shutdown_grading_executor():
+    _grading_executor.shutdown(wait=False, cancel_futures=True)
+    get_client_registry().close()
+
+def _normalize_api_key(api_key: str | None) -> str | None:
+    """Extract the sk- token from pasted input like 'OPENAI_API_KEY=sk-...' or quoted keys"""
+    raw = (api_key or "").strip().strip('"').strip("'")
+    # Support newer project keys like sk-proj-... and variants
+    match = re.search(r"(sk-[A-Za-z0-9_\-]{20,})", raw)
+    return match.group(1) if match else None
+
+# Annotated images are served as binary from /images/{id}, not inlined as base64.
+# Originals also go to MIILA_IMAGE_STORE_DIR, so any worker can serve any id, also after a restart
+_image_store = AnnotatedImageStore()
+
+def _build_grading_response(annotated_bytes: bytes | None, summary: dict, analysis: dict) -> dict:
+    image_id = _image_store.put(annotated_bytes) if annotated_bytes else None
+
+    # Parse the report to extract problems
+    problems = analysis.get('problems', []) if isinstance(analysis, dict) else []
+
+    # Prepare response
+    return {
+        "success": True,
+        "problems": problems,
+        "summary": summary,
+        "annotated_image_id": image_id,
+        "annotated_image_url": f"/images/{image_id}" if image_id else None,
+        "total_problems": len(problems),
+        "stats": {
+            "perfect": len([p for p in problems if p.get('status') == 'perfect']),
+            "correct_no_steps": len([p for p in problems if p.get('status') == 'correct_no_steps']),
+            "wrong": len([p for p in problems if p.get('status') == 'wrong']),
+            "empty": len([p for p in problems if p.get('status') == 'empty'])
+        }
+    }
+
+def _grade_worksheet_sync(image_bytes: bytes, ext: str, normalized_key: str | None, mode: str = "vision") -> dict:
+    """Blocking part of /analyze-worksheet: grade in memory and build the response."""
+    # Initialize math checker with API key (reuses the pooled client for this key)
+    checker = SimpleMathChecker(openai_api_key=normalized_key)
+
+    # Analyze the worksheet (always use pre-uploaded image); decoded once, no temp files
+    if mode == "offline":
+        reader = _get_trocr_reader()
+        if reader.available():
+            annotated_bytes, report, summary, analysis = checker.check_worksheet_offline(image_bytes, reader, ext)
+            return _build_grading_response(annotated_bytes, summary, analysis)
+        if not normalized_key:
+            raise HTTPException(status_code=503, detail="Offline grading unavailable: TrOCR model could not be loaded")
+        print("TrOCR unavailable, falling back to GPT-4o grading")
+    annotated_bytes, report, summary, analysis = checker.check_worksheet_bytes(image_bytes, ext)
+    return _build_grading_response(annotated_bytes, summary, analysis)
+
+def _resolve_fixed_worksheet():
+    """In-memory snapshot of the pre-uploaded worksheet to grade (400 if there is none)"""
+    worksheet = _fixed_index.current()
+    if worksheet is None:
+        where = _fixed_index.fixed_path or FIXED_WORKSHEET_DIR
+        raise HTTPException(status_code=400, detail=f"No pre-uploaded worksheet found in {where}. Place a PNG/JPG there.")
+    return worksheet
+
+# -------------------------------
+# Pre-grading of worksheets dropped into uploads/fixed
+# -------------------------------
+# New or modified worksheets are graded as soon as the index sees them, so the
+# first click on analyze is served from memory (or joins the run in progress).
+# Vision grading is only pre-run with an operator key (MIILA_PREGRADE_API_KEY); callers' keys
+# are never spent on background calls. Pre-grades take a grading slot like any request and are
+# skipped when none is free, so they cannot crowd out interactive grading.
+PREGRADE_ENABLED = os.getenv("MIILA_PREGRADE", "1").lower() in ("1", "true", "yes")
+PREGRADE_API_KEY = os.getenv("MIILA_PREGRADE_API_KEY")
+PREGRADE_MAX_RESULTS = 16
+_pregrade_lock = threading.Lock()
+_pregrade_results: dict = {}   # (path, mtime, size, mode) -> Future of the response dict
+_pregrade_skipped = 0
+
+def _pregrade_key(worksheet, mode: str) -> tuple:
+    return (worksheet.path, worksheet.mtime, worksheet.size, mode)
+
+def _pregrade(path: str, mtime: float) -> None:
+    """Index listener: start grading a newly seen worksheet on the grading executor"""
+    global _pregrade_skipped
+    if not PREGRADE_ENABLED:
+        return
+    normalized_key = _normalize_api_key(PREGRADE_API_KEY)
+    if not normalized_key and GRADING_MODE != "offline":
+        return
+    # Only the worksheet requests will be served (older files at startup are not worth a GPT-4o call);
+    # the index has already loaded it before notifying listeners
+    worksheet = _fixed_index.current()
+    if worksheet is None or worksheet.path != path or worksheet.mtime != mtime:
+        return
+    key = _pregrade_key(worksheet, GRADING_MODE)
+    with _pregrade_lock:
+        if key in _pregrade_results:
+            return
+        # Same bound as requests: the slot is held until the pre-grade finishes
+        if not _grading_slots.acquire(blocking=False):
+            _pregrade_skipped += 1
+            return
+        try:
+            future = _grading_executor.submit(_grade_worksheet_sync, worksheet.data, worksheet.ext, normalized_key, GRADING_MODE)
+        except RuntimeError:
+            # Executor already shut down
+            _grading_slots.release()
+            return
+        future.add_done_callback(lambda _f: _grading_slots.release())
+        _pregrade_results[key] = future
+        while len(_pregrade_results) > PREGRADE_MAX_RESULTS:
+            _pregrade_results.pop(next(iter(_pregrade_results)))
+    print(f"Pre-grading {os.path.basename(worksheet.path)}")
+
+_fixed_index.add_listener(_pregrade)
+
+def _pregraded(worksheet, mode: str):
+    """Future of a finished or in-flight pre-grade for this exact file version, None if unusable"""
+    with _pregrade_lock:
+        future = _pregrade_results.get(_pregrade_key(worksheet, mode))
+    if future is None or future.cancelled():
+        return None
+    if future.done() and future.exception() is not None:
+        # e.g. the stored key was revoked; grade again with the caller's key
+        return None
+    return future
+
+async def _pregraded_response(worksheet, mode: str) -> dict | None:
+    future = _pregraded(worksheet, mode)
+    if future is None:
+        return None
+    try:
+        # Shared by every waiter: a disconnecting client must not cancel it for the others
+        return await asyncio.shield(asyncio.wrap_future(future))
+    except Exception:
+        return None
+
+@app.get("/pregrade/stats")
+async def pregrade_stats():
+    """Pre-graded worksheet versions and their state"""
+    with _pregrade_lock:
+        items = list(_pregrade_results.items())
+    return {
+        "enabled": PREGRADE_ENABLED,
+        "has_key": bool(_normalize_api_key(PREGRADE_API_KEY)),
+        "skipped_no_slot": _pregrade_skipped,
+        "results": [
+            {
+                "file": os.path.basename(path),
+                "mode": mode,
+                "state": "running" if not f.done() else ("failed" if f.cancelled() or f.exception() is not None else "ready"),
+            }
+            for (path, _, _, mode), f in items
+        ],
+    }
+
+@app.get("/images/stats")
+async def image_store_stats():
+    """Size and variant hit/miss counters of the annotated image store"""
+    return _image_store.stats()
+
+@app.get("/images/{image_id}")
+async def get_annotated_image(
+    image_id: str,
+    request: Request,
+    format: str | None = Query(None, description="png, jpeg or webp (default: as graded)"),
+    quality: int | None = Query(None, ge=1, le=100),
+    thumb: int | None = Query(None, ge=16, le=4096, description="Longest edge in pixels"),
+):
+    """
+    Annotated worksheet image by id, optionally re-encoded or downsized. Content-addressed,
+    so responses are immutable: strong ETag, long-lived Cache-Control and byte ranges.
+    """
+    if format and format.lower() not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(sorted(IMAGE_FORMATS))}")
+    if format or thumb:
+        # Re-encoding is CPU work; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(None, _image_store.get, image_id, format, quality, thumb)
+    else:
+        image = _image_store.get(image_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found or expired, please re-run the analysis")
+
+    headers = {
+        "ETag": image.etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if image.etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    size = len(image.data)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != image.etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return Response(content=image.data, media_type=image.media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=image.data[start:end + 1], status_code=206, media_type=image.media_type, headers=headers)
+
 @app.post("/analyze-worksheet")
 async def analyze_worksheet(
     file: UploadFile = File(...),
-    api_key: str = Form(...)
+    api_key: str = Form(...),
+    mode: str | None = Form(None)
 ):
     """
     Analyze a math worksheet image and return results with feedback
     """
     try:
-        # Validate file type (frontend may still send a dummy image)
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
+        # Validate file type (frontend may still send a dummy image); its bytes are never read
+        check_upload_type(file)
+        await file.close()
 
         # Always use the most recently pre-uploaded worksheet from uploads/fixed
-        upload_dir = os.path.join(os.path.dirname(__file__), 'uploads', 'fixed')
-        os.makedirs(upload_dir, exist_ok=True)
-        try:
-            candidates = [
-                os.path.join(upload_dir, name)
-                for name in os.listdir(upload_dir)
-                if name.lower().endswith((".png", ".jpg", ".jpeg"))
-            ]
-        except Exception:
-            candidates = []
-        if not candidates:
-            raise HTTPException(status_code=400, detail=f"No pre-uploaded worksheet found in {upload_dir}. Place a PNG/JPG there.")
-        input_path = max(candidates, key=lambda p: os.path.getmtime(p))
+        worksheet = _resolve_fixed_worksheet()
         
         try:
             # Normalize API key (handle 'OPENAI_API_KEY=sk-...' or quotes)
-            raw = (api_key or "").strip().strip('"').strip("'")
-            # Support newer project keys like sk-proj-... and variants
-            match = re.search(r"(sk-[A-Za-z0-9_\-]{20,})", raw)
-            normalized_key = match.group(1) if match else None
-            if not normalized_key:
+            normalized_key = _normalize_api_key(api_key)
+            grading_mode = (mode or GRADING_MODE).lower()
+            # Offline (TrOCR) grading only needs a key to escalate uncertain crops
+            if not normalized_key and grading_mode != "offline":
                 raise HTTPException(status_code=400, detail="API key must contain a valid sk- token")
-            # Debug: Log API key format (first 10 chars only for security)
-            print(f"Received API key: {normalized_key[:10]}... (length: {len(normalized_key)})")
-            
-            # Initialize math checker with API key
-            checker = SimpleMathChecker(openai_api_key=normalized_key)
-            
-            # Analyze the worksheet (always use pre-uploaded image)
-            result_path, report, summary, analysis = checker.check_worksheet(input_path)
-            
-            # Read the annotated image
-            annotated_image_b64 = None
-            if result_path and os.path.exists(result_path):
-                with open(result_path, 'rb') as img_file:
-                    img_data = img_file.read()
-                    annotated_image_b64 = base64.b64encode(img_data).decode('utf-8')
-
-                # Clean up the result file immediately (do not persist reports)
-                try:
-                    os.unlink(result_path)
-                except Exception:
-                    pass
-
-                # Extra cleanup: remove ANY '*_checked*' artifacts in uploads/fixed
-                try:
-                    fixed_dir = os.path.join(os.path.dirname(__file__), 'uploads', 'fixed')
-                    if os.path.isdir(fixed_dir):
-                        for fname in os.listdir(fixed_dir):
-                            fn_lower = fname.lower()
-                            if ('_checked' in fn_lower) and fn_lower.endswith(('.png', '.jpg', '.jpeg')):
-                                try:
-                                    os.unlink(os.path.join(fixed_dir, fname))
-                                except Exception:
-                                    pass
-                except Exception:
-                    pass
-            
-            # Parse the report to extract problems
-            problems = analysis.get('problems', []) if isinstance(analysis, dict) else []
-            
-            # Prepare response
-            response_data = {
-                "success": True,
-                "problems": problems,
-                "summary": summary,
-                "annotated_image": annotated_image_b64,
-                "total_problems": len(problems),
-                "stats": {
-                    "perfect": len([p for p in problems if p.get('status') == 'perfect']),
-                    "correct_no_steps": len([p for p in problems if p.get('status') == 'correct_no_steps']),
-                    "wrong": len([p for p in problems if p.get('status') == 'wrong']),
-                    "empty": len([p for p in problems if p.get('status') == 'empty'])
-                }
-            }
+            if normalized_key:
+                # Debug: Log API key format (first 10 chars only for security)
+                print(f"Received API key: {normalized_key[:10]}... (length: {len(normalized_key)})")
+
+            # Pre-graded (or still grading) since it landed in uploads/fixed
+            response_data = await _pregraded_response(worksheet, grading_mode)
+            if response_data is None:
+                # Grade off the event loop so health checks and signaling stay responsive
+                response_data = await _run_grading(_grade_worksheet_sync, worksheet.data, worksheet.ext, normalized_key, grading_mode)
             
             return JSONResponse(content=response_data)
             
+        except HTTPException:
+            raise
         except Exception as e:
             err = str(e)
             # Avoid printing emoji content to Windows console
@@ -218,6 +406,8 @@ async def analyze_worksheet(
         finally:
             pass
                 
+    except HTTPException:
+        raise
     except Exception as e:
         # Avoid emoji in console
         try:
@@ -227,6 +417,322 @@ async def analyze_worksheet(
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+@app.post("/analyze-worksheet/stream")
+async def analyze_worksheet_stream(
+    file: UploadFile = File(...),
+    api_key: str = Form(...)
+):
+    """
+    Same as /analyze-worksheet, but as Server-Sent Events: one `problem` event per problem as
+    GPT-4o produces it, then a `result` event with the full response (or an `error` event)
+    """
+    check_upload_type(file)
+    await file.close()
+    worksheet = _resolve_fixed_worksheet()
+    normalized_key = _normalize_api_key(api_key)
+    if not normalized_key:
+        raise HTTPException(status_code=400, detail="API key must contain a valid sk- token")
+
+    if _pregraded(worksheet, "vision") is not None:
+        # Replay the pre-graded result (waiting for it if it is still running)
+        async def replay():
+            response_data = await _pregraded_response(worksheet, "vision")
+            if response_data is None:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Pre-grading failed, please retry'})}\n\n"
+                return
+            for index, problem in enumerate(response_data.get("problems", [])):
+                yield f"event: problem\ndata: {json.dumps({'index': index, 'problem': problem})}\n\n"
+            yield f"event: result\ndata: {json.dumps(response_data)}\n\n"
+
+        return StreamingResponse(
+            replay(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    if not _grading_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Grading queue is full, please retry shortly")
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed (server shutting down)
+            pass
+
+    def produce():
+        try:
+            checker = SimpleMathChecker(openai_api_key=normalized_key)
+            index = 0
+            for kind, payload in checker.check_worksheet_stream(worksheet.data, worksheet.ext):
+                if kind == "problem":
+                    emit(("problem", {"index": index, "problem": payload}))
+                    index += 1
+                elif kind == "error":
+                    emit(("error", payload))
+                else:
+                    annotated_bytes, report, summary, analysis = payload
+                    emit(("result", _build_grading_response(annotated_bytes, summary, analysis)))
+        except Exception as e:
+            emit(("error", {"detail": f"Analysis failed: {e}"}))
+        finally:
+            emit(None)
+            _grading_slots.release()
+
+    try:
+        _grading_executor.submit(produce)
+    except RuntimeError:
+        _grading_slots.release()
+        raise HTTPException(status_code=503, detail="Grading executor is shutting down")
+
+    async def events():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            kind, data = item
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# -------------------------------
+# Batch grading (whole class in one request)
+# -------------------------------
+BATCH_WORKERS = max(1, int(os.getenv("MIILA_BATCH_WORKERS", "6")))
+BATCH_MAX_ITEMS = max(1, int(os.getenv("MIILA_BATCH_MAX_ITEMS", "60")))
+BATCH_MAX_JOBS = max(1, int(os.getenv("MIILA_BATCH_MAX_JOBS", "50")))
+# Unfinished jobs accepted at once; bounds the executor queue to BATCH_MAX_ACTIVE_JOBS * BATCH_MAX_ITEMS items
+BATCH_MAX_ACTIVE_JOBS = max(1, int(os.getenv("MIILA_BATCH_MAX_ACTIVE_JOBS", "4")))
+_IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="miila-batch")
+_batch_lock = threading.Lock()
+_batch_jobs: dict[str, dict] = {}
+
+@app.on_event("shutdown")
+def _shutdown_batch_executor():
+    _batch_executor.shutdown(wait=False, cancel_futures=True)
+
+def _expand_batch_upload(filename: str, contents: bytes, max_items: int, max_bytes: int) -> list[tuple[str, bytes]]:
+    """
+    Split one upload into (name, image bytes) items; zips are unpacked in memory.
+    Entry count and uncompressed sizes are checked from the zip directory before anything
+    is decompressed, so a small archive cannot expand past the batch limits.
+    """
+    if filename.lower().endswith(".zip") or zipfile.is_zipfile(io.BytesIO(contents)):
+        items = []
+        total = 0
+        with zipfile.ZipFile(io.BytesIO(contents)) as zf:
+            for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                name = info.filename
+                base = os.path.basename(name)
+                if info.is_dir() or base.startswith(".") or "__MACOSX" in name:
+                    continue
+                if not base.lower().endswith(_IMAGE_EXTS):
+                    continue
+                if len(items) >= max_items:
+                    raise HTTPException(status_code=413, detail=f"Too many worksheets (limit {BATCH_MAX_ITEMS})")
+                if info.file_size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{base} is too large (limit {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)")
+                total += info.file_size
+                if total > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Batch too large when unpacked (limit {BATCH_UPLOAD_MAX_BYTES // (1024 * 1024)} MB)")
+                # ZipExtFile never returns more than the declared file_size
+                items.append((base, zf.read(info)))
+        return items
+    if max_items < 1:
+        raise HTTPException(status_code=413, detail=f"Too many worksheets (limit {BATCH_MAX_ITEMS})")
+    if len(contents) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"{filename} is too large (limit {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)")
+    return [(filename, contents)]
+
+def _class_stats(items: list[dict]) -> dict:
+    """Aggregate per-worksheet summaries into one class summary of the same shape"""
+    totals = {"total": 0, "perfect": 0, "correct_no_steps": 0, "wrong": 0, "empty": 0}
+    for item in items:
+        summary = (item.get("result") or {}).get("summary") or {}
+        for k in totals:
+            totals[k] += int(summary.get(k, 0) or 0)
+    return totals
+
+def _batch_job_view(job: dict) -> dict:
+    items = job["items"]
+    counts = {s: sum(1 for i in items if i["status"] == s) for s in ("queued", "running", "done", "error")}
+    finished = counts["done"] + counts["error"]
+    return {
+        "job_id": job["job_id"],
+        "status": "done" if finished == len(items) else "running",
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+        "counts": counts,
+        "items": items,
+        "class_summary": _class_stats([i for i in items if i["status"] == "done"]),
+    }
+
+def _grade_batch_item(job_id: str, index: int, contents: bytes, normalized_key: str) -> None:
+    with _batch_lock:
+        item = _batch_jobs[job_id]["items"][index]
+        item["status"] = "running"
+        item["started_at"] = time.time()
+    try:
+        checker = SimpleMathChecker(openai_api_key=normalized_key)
+        ext = os.path.splitext(item["filename"])[1].lower() or ".png"
+        annotated_bytes, report, summary, analysis = checker.check_worksheet_bytes(contents, ext)
+        result = _build_grading_response(annotated_bytes, summary, analysis)
+        with _batch_lock:
+            item["result"] = result
+            item["status"] = "done"
+    except Exception as e:
+        with _batch_lock:
+            item["error"] = str(e)
+            item["status"] = "error"
+    finally:
+        with _batch_lock:
+            item["finished_at"] = time.time()
+            job = _batch_jobs[job_id]
+            if all(i["status"] in ("done", "error") for i in job["items"]):
+                job["finished_at"] = time.time()
+
+def _active_batch_jobs() -> int:
+    # Caller holds _batch_lock
+    return sum(1 for j in _batch_jobs.values() if not j.get("finished_at"))
+
+def _batch_busy() -> HTTPException:
+    return HTTPException(status_code=429, detail=f"Too many batch jobs in progress (limit {BATCH_MAX_ACTIVE_JOBS}), retry later",
+                         headers={"Retry-After": "30"})
+
+def _prune_batch_jobs() -> None:
+    # Keep memory bounded: drop the oldest finished jobs first
+    with _batch_lock:
+        if len(_batch_jobs) <= BATCH_MAX_JOBS:
+            return
+        finished = sorted((j for j in _batch_jobs.values() if j.get("finished_at")), key=lambda j: j["created_at"])
+        for job in finished[:len(_batch_jobs) - BATCH_MAX_JOBS]:
+            _batch_jobs.pop(job["job_id"], None)
+
+@app.post("/batch/analyze-worksheets")
+async def batch_analyze_worksheets(
+    files: list[UploadFile] = File(...),
+    api_key: str = Form(...)
+):
+    """
+    Queue many worksheets (images and/or zip archives) for concurrent grading; returns a job id
+    """
+    normalized_key = _normalize_api_key(api_key)
+    if not normalized_key:
+        raise HTTPException(status_code=400, detail="API key must contain a valid sk- token")
+    # Refuse before reading the body when the queue is already full; re-checked when the job is added
+    with _batch_lock:
+        if _active_batch_jobs() >= BATCH_MAX_ACTIVE_JOBS:
+            raise _batch_busy()
+
+    uploads: list[tuple[str, bytes]] = []
+    unpacked_bytes = 0
+    for f in files:
+        upload = await read_upload(f, BATCH_UPLOAD_MAX_BYTES, IMAGE_TYPES + ZIP_TYPES)
+        try:
+            # Remaining item and byte budget is shared by every file of the request
+            items = _expand_batch_upload(f.filename or "worksheet.png", upload.data,
+                                         BATCH_MAX_ITEMS - len(uploads), BATCH_UPLOAD_MAX_BYTES - unpacked_bytes)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"Could not read zip archive {f.filename}")
+        uploads.extend(items)
+        unpacked_bytes += sum(len(data) for _, data in items)
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No PNG/JPG worksheets found in upload")
+
+    job_id = str(uuid.uuid4())
+    job = {
+        "job_id": job_id,
+        "created_at": time.time(),
+        "finished_at": None,
+        "items": [
+            {"index": i, "filename": name, "status": "queued", "result": None, "error": None,
+             "started_at": None, "finished_at": None}
+            for i, (name, _) in enumerate(uploads)
+        ],
+    }
+    with _batch_lock:
+        if _active_batch_jobs() >= BATCH_MAX_ACTIVE_JOBS:
+            raise _batch_busy()
+        _batch_jobs[job_id] = job
+    _prune_batch_jobs()
+
+    for i, (_, contents) in enumerate(uploads):
+        _batch_executor.submit(_grade_batch_item, job_id, i, contents, normalized_key)
+
+    return JSONResponse(status_code=202, content={"job_id": job_id, "total": len(uploads), "status": "running"})
+
+@app.get("/batch/jobs/{job_id}")
+async def batch_job_status(job_id: str):
+    """Per-item status, partial results and class summary for a batch job"""
+    with _batch_lock:
+        job = _batch_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown batch job")
+        return JSONResponse(content=_batch_job_view(job))
+
+
+# -------------------------------
+# Live grading from StudentPublisher snapshots
+# -------------------------------
+# Frames are hashed per problem region; only changed problems are re-read with TrOCR
+# (GPT-4o only for uncertain crops, and only with a key). Updates go to the room's
+# viewers over /ws/signal as {"type": "grading", ...}.
+LIVE_MAX_SNAPSHOT_BYTES = 8 * 1024 * 1024
+_live_grader = LiveGrader()
+
+def _grade_live_frame(room: str, contents: memoryview, normalized_key: str | None) -> dict | None:
+    """Blocking part of /live/{room}/snapshot: None if the frame was skipped or nothing changed"""
+    session = _live_grader.session(room)
+    # One frame per room at a time; frames arriving meanwhile are stale anyway
+    if not session.lock.acquire(blocking=False):
+        session.skipped += 1
+        return None
+    try:
+        image = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise HTTPException(status_code=400, detail="Snapshot is not a decodable image")
+        reader = _get_trocr_reader()
+        if not reader.available():
+            raise HTTPException(status_code=503, detail="Live grading unavailable: TrOCR model could not be loaded")
+        checker = SimpleMathChecker(openai_api_key=normalized_key)
+        analysis, changed = _live_grader.process(session, image, checker, reader)
+        if analysis is None:
+            return None
+        ok, encoded = cv2.imencode(".jpg", checker.render_feedback(image, analysis), [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+        response = _build_grading_response(encoded.tobytes() if ok else None, checker.summarize(analysis), analysis)
+        response["changed"] = changed
+        return response
+    finally:
+        session.lock.release()
+
+@app.post("/live/{room}/snapshot")
+async def live_snapshot(room: str, file: UploadFile = File(...), api_key: str | None = Form(None)):
+    """
+    Ingest one camera snapshot (JPEG) for a room. Re-grades only the problems whose region
+    changed and pushes the merged result to the room's viewers.
+    """
+    upload = await read_upload(file, LIVE_MAX_SNAPSHOT_BYTES)
+    response_data = await _run_grading(_grade_live_frame, room, upload.view(), _normalize_api_key(api_key))
+    if response_data is None:
+        return {"updated": False}
+    _signaling_hub.publish(room, json.dumps({"type": "grading", "changed": response_data["changed"], "result": response_data}))
+    return {"updated": True, "changed": response_data["changed"], "result": response_data}
+
+@app.get("/live/stats")
+async def live_stats():
+    """Frames, skipped frames and re-graded problems per room"""
+    return _live_grader.stats()
+
+
 # -------------------------------
 # Simple POC variant rotation (no LLM)
 # -------------------------------
@@ -287,140 +793,282 @@ def _score_text(s: str) -> float:
     ratio = letters / max(1, len(s))
     return letters * (0.6 + 0.4 * ratio)
 
+# Heavy ML imports are deferred until an OCR path (or warm-up) first needs them, so the
+# worksheet, auth, tutor and signaling routes start without paying for torch/transformers.
 @lru_cache(maxsize=1)
-def _get_easyocr_reader():
-    if easyocr is None:
+def _import_torch():
+    try:
+        import torch
+        return torch
+    except Exception:
         return None
+
+@lru_cache(maxsize=1)
+def _import_easyocr():
     try:
-        return easyocr.Reader(['en'], gpu=(hasattr(torch,"cuda") and torch.cuda.is_available()))
+        import easyocr
+        return easyocr
     except Exception:
         return None
 
 @lru_cache(maxsize=1)
-def _get_trocr_models():
-    if TrOCRProcessor is None or VisionEncoderDecoderModel is None:
-        return (None, None)
+def _import_trocr_classes():
     try:
-        proc = TrOCRProcessor.from_pretrained("microsoft/trocr-base-handwritten")
-        model = VisionEncoderDecoderModel.from_pretrained("microsoft/trocr-base-handwritten")
-        return (proc, model)
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+        return (TrOCRProcessor, VisionEncoderDecoderModel)
     except Exception:
         return (None, None)
 
-def _perform_ocr(image_path: str) -> str:
-    texts = []
+def _load_easyocr_reader():
+    easyocr = _import_easyocr()
+    if easyocr is None:
+        return None
+    torch = _import_torch()
     try:
-        img_bgr = cv2.imread(image_path)
-        prep = _preprocess_for_ocr(img_bgr)
-        # TrOCR PRIMARY
-        proc, model = _get_trocr_models()
-        if proc is not None and model is not None:
-            try:
-                from PIL import Image as PILImage
-                image = PILImage.open(image_path).convert("RGB")
-                pixel_values = proc(images=image, return_tensors="pt").pixel_values
-                generated_ids = model.generate(pixel_values)
-                o_text = proc.batch_decode(generated_ids, skip_special_tokens=True)[0]
-                o_text = _clean_text(o_text)
-                if o_text:
-                    texts.append((o_text, _score_text(o_text) + 3))
-            except Exception:
-                pass
-        # EasyOCR fallback
-        reader = _get_easyocr_reader()
-        if reader is not None:
-            try:
-                res = reader.readtext(image_path, detail=0, paragraph=False,
-                                       text_threshold=0.3, low_text=0.2, contrast_ths=0.05)
-                e_text = _clean_text(" ".join(res))
-                if e_text:
-                    texts.append((e_text, _score_text(e_text)))
-            except Exception:
-                pass
-            # Band crop attempt for EasyOCR
-            try:
-                if img_bgr is not None:
-                    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-                    h, w = gray.shape[:2]
-                    band = img_bgr[0:int(0.4*h), :]
-                    res2 = reader.readtext(band, detail=0, paragraph=False,
-                                            text_threshold=0.3, low_text=0.2, contrast_ths=0.05)
-                    e2 = _clean_text(" ".join(res2))
-                    if e2:
-                        texts.append((e2, _score_text(e2)))
-            except Exception:
-                pass
-        if not texts:
-            return ""
-        texts.sort(key=lambda x: x[1], reverse=True)
-        return texts[0][0]
+        return easyocr.Reader(['en'], gpu=(hasattr(torch,"cuda") and torch.cuda.is_available()))
     except Exception:
-        return ""
+        return None
 
-def _cosine_similarity(a, b):
-    # retained for backwards compatibility if needed elsewhere
-    if not a or not b:
-        return 0.0
-    if len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a))
-    nb = math.sqrt(sum(y * y for y in b))
-    if na == 0 or nb == 0:
-        return 0.0
-    return dot / (na * nb)
-
-def _load_rag_store() -> list:
-    if not os.path.exists(RAG_STORE_PATH):
-        # Seed with 10 simple variants if file not present
-        seed_items = [
-            {"id": 1, "title": "Build a paper rocket", "content": "To build a simple paper rocket: roll paper into a tube, tape fins, add a cone, and launch with a straw or compressed air."},
-            {"id": 2, "title": "Model rocket basics", "content": "Model rockets use a body tube, nose cone, fins, and a solid motor. Follow safety code: stable center of gravity ahead of center of pressure."},
-            {"id": 3, "title": "Spacecraft subsystems", "content": "A spacecraft needs power, propulsion, guidance, communication, thermal control, and structure. Trade mass, power, and reliability."},
-            {"id": 4, "title": "Propulsion overview", "content": "Chemical rockets provide high thrust; electric propulsion provides high efficiency but low thrust for deep space."},
-            {"id": 5, "title": "Safety first", "content": "Never build or ignite engines without certified kits and adult supervision. Use model rocketry standards and safe launch sites."},
-            {"id": 6, "title": "Aerodynamics", "content": "Fins stabilize flight. Keep them symmetric and aligned. Reduce drag with smooth surfaces and a pointed nose cone."},
-            {"id": 7, "title": "Materials", "content": "For hobby builds use cardboard, balsa, PLA prints, and epoxy. For real aerospace: aluminum, carbon fiber, and space-rated electronics."},
-            {"id": 8, "title": "Guidance basics", "content": "Simple rockets use passive stabilization. Advanced systems use IMU sensors, flight computers, and thrust vector control."},
-            {"id": 9, "title": "Power systems", "content": "Small projects use LiPo batteries with proper BMS and fuses. Spacecraft often use solar panels with MPPT and battery packs."},
-            {"id": 10, "title": "Learning path", "content": "Start with model rocket kits, then avionics (altimeters, GPS), then small liquid engines in university teams under supervision."}
-        ]
-        seed = {
-            "items": seed_items,
-            "poc_variants": [
-                "You can build a simple paper rocket. Roll paper into a tube, tape on three fins, make a small cone for the nose, and launch it by blowing through a straw.",
-                "Try a straw rocket: tape a small paper tube onto a straw, add fins and a pointed nose, then use a bigger straw as a launcher to puff it into the air.",
-                "Start with a safe model rocket kit. It has a tube, fins, and a small engine. Follow the instructions and adult supervision to launch it.",
-                "Think like a spaceship: you need a body, fins to keep it straight, and power. For a kid project, air power from a straw or a soda-bottle launcher is perfect.",
-                "Make it stable: keep the heavy part (nose) a little forward, and fins at the back nice and straight. Smooth tape reduces drag for higher flights."
-            ]
-        }
-        with open(RAG_STORE_PATH, "w", encoding="utf-8") as f:
-            json.dump(seed, f, ensure_ascii=False, indent=2)
+def _load_trocr_models():
+    if TROCR_BACKEND in ("onnx", "auto"):
+        models = load_trocr_onnx(TROCR_MODEL_NAME)
+        if models is not None:
+            return models
+        if TROCR_BACKEND == "onnx":
+            print("onnxruntime/optimum not installed, falling back to torch TrOCR")
+    TrOCRProcessor, VisionEncoderDecoderModel = _import_trocr_classes()
+    if TrOCRProcessor is None or VisionEncoderDecoderModel is None:
+        return None
     try:
-        with open(RAG_STORE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # Backward compatibility if file previously stored list
-            if isinstance(data, list):
-                data = {"items": data, "poc_variants": []}
-            # Ensure keys exist
-            data.setdefault("items", [])
-            data.setdefault("poc_variants", [])
-            return data
+        proc = TrOCRProcessor.from_pretrained(TROCR_MODEL_NAME)
+        model = VisionEncoderDecoderModel.from_pretrained(TROCR_MODEL_NAME)
+        return (proc, model)
     except Exception:
-        return {"items": [], "poc_variants": []}
+        return None
+
+# Resident OCR models are unloaded after MIILA_MODEL_IDLE_TTL_SECONDS without use, or
+# least-recently-used first when MIILA_MODEL_MEMORY_MB is exceeded; they reload on demand.
+_model_manager = ModelManager()
+_model_manager.register("easyocr", _load_easyocr_reader,
+                        lambda r: torch_module_bytes(getattr(r, "detector", None), getattr(r, "recognizer", None)))
+_model_manager.register("trocr", _load_trocr_models, trocr_model_bytes)
+
+def _get_easyocr_reader():
+    return _model_manager.get("easyocr")
+
+def _get_trocr_models():
+    return _model_manager.get("trocr") or (None, None)
+
+@app.on_event("startup")
+def _start_model_reaper():
+    _model_manager.start_reaper()
+
+@app.on_event("shutdown")
+def _stop_model_reaper():
+    _model_manager.stop_reaper()
+
+@app.get("/models/stats")
+async def models_stats():
+    """Resident size, load/evict counts and idle time of the OCR models"""
+    return _model_manager.stats()
+
+# Question lines are longer than worksheet answers
+TROCR_LINE_MAX_NEW_TOKENS = 64
 
 @lru_cache(maxsize=1)
-def _get_rag_items_tuple():
-    # kept for future use; not used in POC mode
-    data = _load_rag_store()
-    items = data.get("items", [])
-    return tuple((item.get("id"), item.get("title", ""), item.get("content", "")) for item in items)
+def _get_trocr_reader() -> TrOCRReader:
+    return TrOCRReader(_get_trocr_models)
+
+_EASYOCR_DETECT_ARGS = dict(text_threshold=0.3, low_text=0.2)
+_EASYOCR_RECOGNIZE_ARGS = dict(detail=1, paragraph=False, contrast_ths=0.05)
+
+def _easyocr_read(image, cancelled) -> tuple[str, float]:
+    if image is None or cancelled():
+        return "", 0.0
+    reader = _get_easyocr_reader()
+    if reader is None or cancelled():
+        return "", 0.0
+    # readtext() is detect + recognize; split so a cascade that already has its answer skips recognition
+    horizontal, free = reader.detect(image, **_EASYOCR_DETECT_ARGS)
+    if cancelled():
+        return "", 0.0
+    res = reader.recognize(image, horizontal[0], free[0], **_EASYOCR_RECOGNIZE_ARGS)
+    if not res:
+        return "", 0.0
+    return " ".join(r[1] for r in res), sum(float(r[2]) for r in res) / len(res)
+
+def _ocr_engine_trocr(img_bgr, prep, cancelled) -> tuple[str, float]:
+    # TrOCR was trained on natural handwriting images; binarization hurts it
+    if cancelled():
+        return "", 0.0
+    reader = _get_trocr_reader()
+    # available() may (re)load the model; skip inference if the cascade finished meanwhile
+    if not reader.available() or cancelled():
+        return "", 0.0
+    return reader.read_batch([img_bgr], max_new_tokens=TROCR_LINE_MAX_NEW_TOKENS)[0]
+
+def _ocr_engine_easyocr(img_bgr, prep, cancelled) -> tuple[str, float]:
+    # EasyOCR's text detector benefits from the upscaled, blue-ink-boosted binarization
+    return _easyocr_read(prep if prep is not None else img_bgr, cancelled)
+
+def _ocr_engine_easyocr_band(img_bgr, prep, cancelled) -> tuple[str, float]:
+    # Questions are usually written in the top band of the photo
+    h = img_bgr.shape[0]
+    return _easyocr_read(img_bgr[0:int(0.4 * h), :], cancelled)
 
 @lru_cache(maxsize=1)
-def _get_poc_variants_tuple():
-    data = _load_rag_store()
-    return tuple(v for v in data.get("poc_variants", []))
+def _get_ocr_cascade() -> OCRCascade:
+    cascade = OCRCascade()
+    cascade.register("trocr", _ocr_engine_trocr, bonus=3)
+    cascade.register("easyocr", _ocr_engine_easyocr)
+    cascade.register("easyocr_band", _ocr_engine_easyocr_band)
+    return cascade
+
+@app.on_event("shutdown")
+def _shutdown_ocr_cascade():
+    if _get_ocr_cascade.cache_info().currsize:
+        _get_ocr_cascade().shutdown()
+
+@app.get("/ocr/stats")
+async def ocr_stats():
+    """Per-engine latency and win rate of the OCR cascade"""
+    return _get_ocr_cascade().stats()
+
+def _perform_ocr_image(img_bgr) -> str:
+    if img_bgr is None:
+        return ""
+    try:
+        prep = _preprocess_for_ocr(img_bgr)
+        text, _engine = _get_ocr_cascade().run(img_bgr, prep, _clean_text, _score_text)
+        return text
+    except Exception:
+        return ""
+
+def _perform_ocr(image_path: str) -> str:
+    return _perform_ocr_image(cv2.imread(image_path))
+
+# ---------- Model warm-up / readiness ----------
+# Opt-in, comma-separated models to preload at startup ("trocr", "easyocr"). The default vision
+# grading path needs neither, so nothing is loaded unless configured. Every OCR model is optional:
+# /ready turns 200 once warm-up has finished, and a model that failed only marks the worker degraded.
+WARMUP_MODELS = [m.strip().lower() for m in os.getenv("MIILA_WARMUP_MODELS", "").split(",")
+                 if m.strip() and m.strip().lower() != "none"]
+_warmup_lock = threading.Lock()
+# Progress of the warm-up run only; residency and load time come from the ModelManager
+_warmup_state: dict[str, dict] = {name: {"warmup": "pending", "error": None} for name in WARMUP_MODELS}
+
+def _warm_trocr():
+    reader = _get_trocr_reader()
+    if not reader.available():
+        raise RuntimeError("TrOCR could not be loaded")
+    # Dummy inference triggers lazy allocations and kernel selection before real traffic
+    reader.read_batch([np.full((64, 256, 3), 255, dtype=np.uint8)])
+
+def _warm_easyocr():
+    reader = _get_easyocr_reader()
+    if reader is None:
+        raise RuntimeError("EasyOCR could not be loaded")
+    reader.readtext(np.full((64, 256, 3), 255, dtype=np.uint8), detail=0)
+
+_WARMERS = {"trocr": _warm_trocr, "easyocr": _warm_easyocr}
+
+def _warm_up_models():
+    for name in WARMUP_MODELS:
+        warmer = _WARMERS.get(name)
+        with _warmup_lock:
+            if warmer is None:
+                _warmup_state[name].update(warmup="failed", error="unknown model")
+                continue
+            _warmup_state[name]["warmup"] = "loading"
+        try:
+            warmer()
+            with _warmup_lock:
+                _warmup_state[name]["warmup"] = "done"
+        except Exception as e:
+            with _warmup_lock:
+                _warmup_state[name].update(warmup="failed", error=str(e))
+        print(f"Warm-up {name}: {_warmup_state[name]['warmup']}")
+
+@app.on_event("startup")
+def _start_model_warmup():
+    if WARMUP_MODELS:
+        threading.Thread(target=_warm_up_models, name="miila-warmup", daemon=True).start()
+
+def _model_readiness(name: str, warmup: dict | None, managed: dict | None) -> dict:
+    """One model's state for /ready: loading, ready, unloaded (evicted, reloads on demand), failed or not_loaded"""
+    managed = managed or {}
+    if warmup is not None and warmup["warmup"] in ("pending", "loading"):
+        state = "loading"
+    elif (warmup is not None and warmup["warmup"] == "failed") or managed.get("failed"):
+        state = "failed"
+    elif managed.get("resident"):
+        state = "ready"
+    elif managed.get("evictions"):
+        state = "unloaded"
+    else:
+        state = "not_loaded"
+    return {
+        "state": state,
+        "warmup": warmup["warmup"] if warmup is not None else None,
+        "load_seconds": managed.get("load_seconds"),
+        "error": warmup["error"] if warmup is not None else None,
+    }
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness for the load balancer: 503 only while configured warm-up is still running.
+    Failed OCR models report degraded=true; grading paths that need them answer 503 themselves.
+    """
+    with _warmup_lock:
+        warmups = {name: dict(state) for name, state in _warmup_state.items()}
+    managed = _model_manager.stats()["models"]
+    models = {name: _model_readiness(name, warmups.get(name), managed.get(name))
+              for name in list(managed) + [n for n in warmups if n not in managed]}
+    is_ready = not any(m["state"] == "loading" for m in models.values())
+    degraded = any(m["state"] == "failed" for m in models.values())
+    return JSONResponse(status_code=200 if is_ready else 503,
+                        content={"ready": is_ready, "degraded": degraded, "models": models})
+
+# Written to rag_store.json if the file is not present
+_RAG_SEED_ITEMS = [
+    {"id": 1, "title": "Build a paper rocket", "content": "To build a simple paper rocket: roll paper into a tube, tape fins, add a cone, and launch with a straw or compressed air."},
+    {"id": 2, "title": "Model rocket basics", "content": "Model rockets use a body tube, nose cone, fins, and a solid motor. Follow safety code: stable center of gravity ahead of center of pressure."},
+    {"id": 3, "title": "Spacecraft subsystems", "content": "A spacecraft needs power, propulsion, guidance, communication, thermal control, and structure. Trade mass, power, and reliability."},
+    {"id": 4, "title": "Propulsion overview", "content": "Chemical rockets provide high thrust; electric propulsion provides high efficiency but low thrust for deep space."},
+    {"id": 5, "title": "Safety first", "content": "Never build or ignite engines without certified kits and adult supervision. Use model rocketry standards and safe launch sites."},
+    {"id": 6, "title": "Aerodynamics", "content": "Fins stabilize flight. Keep them symmetric and aligned. Reduce drag with smooth surfaces and a pointed nose cone."},
+    {"id": 7, "title": "Materials", "content": "For hobby builds use cardboard, balsa, PLA prints, and epoxy. For real aerospace: aluminum, carbon fiber, and space-rated electronics."},
+    {"id": 8, "title": "Guidance basics", "content": "Simple rockets use passive stabilization. Advanced systems use IMU sensors, flight computers, and thrust vector control."},
+    {"id": 9, "title": "Power systems", "content": "Small projects use LiPo batteries with proper BMS and fuses. Spacecraft often use solar panels with MPPT and battery packs."},
+    {"id": 10, "title": "Learning path", "content": "Start with model rocket kits, then avionics (altimeters, GPS), then small liquid engines in university teams under supervision."}
+]
+_RAG_SEED = {
+    "items": _RAG_SEED_ITEMS,
+    "poc_variants": [
+        "You can build a simple paper rocket. Roll paper into a tube, tape on three fins, make a small cone for the nose, and launch it by blowing through a straw.",
+        "Try a straw rocket: tape a small paper tube onto a straw, add fins and a pointed nose, then use a bigger straw as a launcher to puff it into the air.",
+        "Start with a safe model rocket kit. It has a tube, fins, and a small engine. Follow the instructions and adult supervision to launch it.",
+        "Think like a spaceship: you need a body, fins to keep it straight, and power. For a kid project, air power from a straw or a soda-bottle launcher is perfect.",
+        "Make it stable: keep the heavy part (nose) a little forward, and fins at the back nice and straight. Smooth tape reduces drag for higher flights."
+    ]
+}
+
+# Parsed off the request path and swapped atomically when rag_store.json changes
+_rag_store = RagStoreManager(RAG_STORE_PATH, seed=_RAG_SEED)
+
+@app.on_event("startup")
+def _start_rag_store():
+    _rag_store.start()
+
+@app.on_event("shutdown")
+def _stop_rag_store():
+    _rag_store.stop()
+
+@app.get("/rag/stats")
+async def rag_stats():
+    """Current rag_store snapshot and reload counters"""
+    return _rag_store.stats()
 
 # ---------- Simple auth (single credential) ----------
 VALID_EMAIL = os.getenv("MIILA_ADMIN_EMAIL", "admin@miila.ai")
@@ -446,24 +1094,29 @@ async def auth_login(email: str = Form(...), password: str = Form(...)):
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
 @app.post("/ask")
-async def ask(file: UploadFile = File(...)):
+async def ask(file: UploadFile = File(...), question: str | None = Form(None)):
     """
-    Read a question image (OCR best-effort) and return a rotating stored answer.
+    Answer a question image from rag_store.json: top-k retrieval over the stored items,
+    falling back to the rotating POC variants when no item matches.
     """
     try:
-        contents = await file.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-            tmp_file.write(contents)
-            temp_path = tmp_file.name
+        # Type/size-checked in memory, no temp file; the image is not OCR'd yet (POC)
+        await read_upload(file)
 
-        # Hardcoded recognized text (POC)
-        query_text = "What is life like on a spaceship?"
+        # Question text: sent by the client, else the store's configured question (POC)
+        # One snapshot per request: a concurrent reload cannot mix old variants with a new index
+        store = _rag_store.snapshot()
+        query_text = (question or "").strip() or store.question or "What is life like on a spaceship?"
 
         simplified = query_text
 
-        # POC mode: cycle through predefined variants and skip embeddings
-        variants = list(_get_poc_variants_tuple())
-        if variants:
+        top = store.index.search(query_text, RAG_TOP_K)
+        variants = store.poc_variants
+        if top:
+            best_answer = top[0]["content"]
+            kid_friendly = best_answer
+        elif variants:
+            # POC mode: cycle through predefined variants
             global _variant_counter
             with _variant_lock:
                 idx = _variant_counter % len(variants)
@@ -472,14 +1125,7 @@ async def ask(file: UploadFile = File(...)):
             top = [{"id": idx + 1, "title": "POC Variant", "content": variants[idx], "score": 1.0}]
             kid_friendly = best_answer
         else:
-            # If no variants configured, fall back to the first rag item text if present; else generic.
-            items = list(_get_rag_items_tuple())
-            if items:
-                best_answer = items[0][2]
-                top = [{"id": items[0][0], "title": items[0][1], "content": best_answer, "score": 1.0}]
-            else:
-                best_answer = "No answers configured. Please add text in rag_store.json under 'poc_variants'."
-                top = []
+            best_answer = "No answers configured. Please add text in rag_store.json under 'items' or 'poc_variants'."
             kid_friendly = best_answer
 
         return {
@@ -487,18 +1133,13 @@ async def ask(file: UploadFile = File(...)):
             "extracted_text": query_text,
             "simplified_question": simplified,
             "answer": kid_friendly,
-            "base_answer": best_answer
+            "base_answer": best_answer,
+            "sources": top
         }
     except HTTPException:
         raise
     except Exception as e:
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
-    finally:
-        try:
-            if 'temp_path' in locals() and os.path.exists(temp_path):
-                os.unlink(temp_path)
-        except Exception:
-            pass
 
 # -------------------------------
 # Conversational tutor (POC scripted)
@@ -542,12 +1183,9 @@ async def tutor_next(
     This endpoint does not persist state; the client holds conversation_id.
     """
     try:
-        # swallow uploaded file; not used in POC
+        # Uploaded image is not used in POC; release it without reading
         if file is not None:
-            try:
-                _ = await file.read()
-            except Exception:
-                pass
+            await file.close()
 
         if conversation_id is None or conversation_id.strip() == "":
             conversation_id = str(uuid.uuid4())
@@ -577,19 +1215,18 @@ async def validate_api_key(api_key: str = Form(...)):
     Validate OpenAI API key by attempting a lightweight API call
     """
     try:
-        raw = (api_key or "").strip().strip('"').strip("'")
-        match = re.search(r"(sk-[A-Za-z0-9_\-]{20,})", raw)
-        normalized_key = match.group(1) if match else None
+        normalized_key = _normalize_api_key(api_key)
         if not normalized_key:
             return {"valid": False, "message": "API key must contain a valid sk- token"}
 
         # Try a minimal call: list models (cheap and fast)
-        client = OpenAI(api_key=normalized_key)
+        client = get_openai_client(normalized_key)
         try:
             _ = client.models.list()
         except Exception as e:
             err = str(e)
             if "invalid_api_key" in err or "Incorrect API key provided" in err:
+                get_client_registry().discard(normalized_key)
                 return {"valid": False, "message": "Invalid OpenAI API key"}
             return {"valid": False, "message": f"OpenAI error: {err}"}
 
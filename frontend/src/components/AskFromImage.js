@@ -279,7 +279,10 @@ const AskFromImage = () => {
 
       ws.onmessage = async (ev) => {
         const data = JSON.parse(ev.data || '{}');
-        if (data.type === 'offer') {
+        if (data.type === 'ping') {
+          // Server heartbeat: answer or the server reaps this socket as dead
+          ws.send(JSON.stringify({ type: 'pong' }));
+        } else if (data.type === 'offer') {
           await pc.setRemoteDescription({ type: 'offer', sdp: data.sdp });
           const answer = await pc.createAnswer();
           await pc.setLocalDescription(answer);
@@ -16,9 +16,9 @@ const ResultsDisplay = ({ results }) => {
   
   const handleExport = () => {
     try {
-      if (results && results.annotated_image) {
+      if (results && results.annotated_image_url) {
         const link = document.createElement('a');
-        link.href = `data:image/png;base64,${results.annotated_image}`;
+        link.href = `${window.location.origin}${results.annotated_image_url}?format=png`;
         link.download = 'miila_report.png';
         document.body.appendChild(link);
         link.click();
@@ -128,10 +128,11 @@ const ResultsDisplay = ({ results }) => {
             Digital Preview / Feedback
           </h3>
           
-          {results.annotated_image ? (
+          {results.annotated_image_url ? (
             <div className="space-y-4">
               <img
-                src={`data:image/png;base64,${results.annotated_image}`}
+                src={`${window.location.origin}${results.annotated_image_url}?format=webp&quality=85&thumb=1600`}
+                decoding="async"
                 alt="Analyzed worksheet"
                 className="w-full rounded-lg shadow-sm border"
               />
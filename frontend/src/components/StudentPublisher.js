@@ -9,6 +9,9 @@ const ICE_SERVERS = [
   }
 ];
 
+// Live grading: the server re-reads only problems whose region changed between snapshots
+const SNAPSHOT_INTERVAL_MS = 3000;
+
 const StudentPublisher = () => {
   const [room, setRoom] = useState('default');
   const [connected, setConnected] = useState(false);
@@ -23,6 +26,8 @@ const StudentPublisher = () => {
   const [videoDevices, setVideoDevices] = useState([]);
   const [selectedDeviceId, setSelectedDeviceId] = useState('');
   const localStreamRef = useRef(null);
+  const snapshotTimerRef = useRef(null);
+  const snapshotBusyRef = useRef(false);
 
   useEffect(() => {
     const params = new URLSearchParams(window.location.search);
@@ -51,6 +56,25 @@ const StudentPublisher = () => {
     return stream;
   };
 
+  const sendSnapshot = () => {
+    const video = videoRef.current;
+    if (!video || !video.videoWidth || snapshotBusyRef.current) return;
+    snapshotBusyRef.current = true;
+    const canvas = document.createElement('canvas');
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
+    canvas.toBlob(async (blob) => {
+      try {
+        if (!blob) return;
+        const form = new FormData();
+        form.append('file', blob, 'snapshot.jpg');
+        await fetch(`${window.location.origin}/live/${encodeURIComponent(room)}/snapshot`, { method: 'POST', body: form });
+      } catch {}
+      finally { snapshotBusyRef.current = false; }
+    }, 'image/jpeg', 0.85);
+  };
+
   const start = async () => {
     const pc = new RTCPeerConnection({ iceServers: ICE_SERVERS });
     pcRef.current = pc;
@@ -87,7 +111,10 @@ const StudentPublisher = () => {
 
     ws.onmessage = async (ev) => {
       const data = JSON.parse(ev.data || '{}');
-      if (data.type === 'answer') {
+      if (data.type === 'ping') {
+        // Server heartbeat: answer or the server reaps this socket as dead
+        ws.send(JSON.stringify({ type: 'pong' }));
+      } else if (data.type === 'answer') {
         if (pc.signalingState === 'have-local-offer') {
           try { await pc.setRemoteDescription({ type: 'answer', sdp: data.sdp }); } catch {}
         }
@@ -116,6 +143,8 @@ const StudentPublisher = () => {
       } catch {}
       outQueueRef.current = [];
       setConnected(true);
+      clearInterval(snapshotTimerRef.current);
+      snapshotTimerRef.current = setInterval(sendSnapshot, SNAPSHOT_INTERVAL_MS);
     };
   };
 
@@ -169,6 +198,8 @@ const StudentPublisher = () => {
   };
 
   const stop = () => {
+    clearInterval(snapshotTimerRef.current);
+    snapshotTimerRef.current = null;
     try { wsRef.current?.close(); } catch {}
     try { pcRef.current?.close(); } catch {}
     try { localStreamRef.current?.getTracks().forEach(t => t.stop()); } catch {}
@@ -229,13 +229,19 @@ const WorksheetUpload = ({ apiKey, onWorksheetAnalyzed }) => {
       const outQueue = [];
       ws.onmessage = async (ev) => {
         const data = JSON.parse(ev.data || '{}');
-        if (data.type === 'offer') {
+        if (data.type === 'ping') {
+          // Server heartbeat: answer or the server reaps this socket as dead
+          ws.send(JSON.stringify({ type: 'pong' }));
+        } else if (data.type === 'offer') {
           await pc.setRemoteDescription({ type: 'offer', sdp: data.sdp });
           const answer = await pc.createAnswer();
           await pc.setLocalDescription(answer);
           ws.send(JSON.stringify({ type: 'answer', sdp: answer.sdp }));
         } else if (data.type === 'ice') {
           try { await pc.addIceCandidate(data.candidate); } catch {}
+        } else if (data.type === 'grading' && data.result) {
+          // Live result pushed after the student's latest snapshot
+          onWorksheetAnalyzed(data.result);
         }
       };
       pc.onicecandidate = (e) => {
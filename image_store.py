@@ -0,0 +1,256 @@
+"""
+Annotated image store
+Content-addressed store of encoded annotated worksheets plus their re-encoded variants
+(format / quality / thumbnail), served by GET /images/{image_id}. Originals are also written
+to a shared directory, so every uvicorn worker (and a restarted one) can serve any id.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from vision_payload import sniff_mime
+
+IMAGE_STORE_MB = int(os.getenv("MIILA_IMAGE_STORE_MB", "256"))
+# Shared by all workers on a host; point at a shared volume when running several hosts
+IMAGE_STORE_DIR = os.getenv("MIILA_IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "images"))
+IMAGE_STORE_DISK_MB = int(os.getenv("MIILA_IMAGE_STORE_DISK_MB", "1024"))
+IMAGE_DEFAULT_QUALITY = 85
+
+IMAGE_FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "jpg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+
+class StoredImage:
+    """Encoded bytes, media type and strong ETag of one image variant"""
+
+    __slots__ = ("data", "media_type", "etag")
+
+    def __init__(self, data: bytes, media_type: str):
+        self.data = data
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+_IMAGE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class AnnotatedImageStore:
+    """
+    Memory LRU by total bytes in front of a disk tier of originals. Originals are keyed by their
+    SHA-256, variants by (id, format, quality, thumb); variants are re-encoded on demand, never stored on disk.
+    """
+
+    def __init__(self, max_mb: int = IMAGE_STORE_MB, cache_dir: Optional[str] = IMAGE_STORE_DIR,
+                 max_disk_mb: int = IMAGE_STORE_DISK_MB):
+        self.max_bytes = max(1, max_mb) * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max(0, max_disk_mb) * 1024 * 1024
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple, StoredImage]" = OrderedDict()
+        self._bytes = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+        self.disk_hits = 0
+
+    def _insert(self, key: Tuple, image: StoredImage) -> None:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return
+            self._items[key] = image
+            self._bytes += len(image.data)
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= len(old.data)
+
+    def _lookup(self, key: Tuple) -> Optional[StoredImage]:
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def _disk_path(self, image_id: str) -> Optional[str]:
+        if not self.cache_dir or not self.max_disk_bytes or not _IMAGE_ID.fullmatch(image_id):
+            return None
+        return os.path.join(self.cache_dir, f"{image_id}.img")
+
+    def _write_disk(self, image_id: str, data: bytes) -> None:
+        path = self._disk_path(image_id)
+        if not path:
+            return
+        try:
+            if os.path.exists(path):
+                # Same id, same bytes: just mark it recently used
+                os.utime(path, None)
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            print(f"Image store write failed: {e}")
+
+    def _read_disk(self, image_id: str) -> Optional[StoredImage]:
+        path = self._disk_path(image_id)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except OSError:
+            return None
+        # Content-addressed: a torn or foreign file never matches its name
+        if not data or hashlib.sha256(data).hexdigest()[:32] != image_id:
+            return None
+        return StoredImage(data, sniff_mime(data))
+
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".img"):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        return files
+
+    def _evict_disk(self) -> None:
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_disk_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def put(self, data: bytes) -> str:
+        """
+        Store encoded image bytes and return their id (hex SHA-256 prefix)
+        """
+        image_id = hashlib.sha256(data).hexdigest()[:32]
+        self._insert((image_id,), StoredImage(bytes(data), sniff_mime(data)))
+        self._write_disk(image_id, data)
+        return image_id
+
+    def _original(self, image_id: str) -> Optional[StoredImage]:
+        original = self._lookup((image_id,))
+        if original is None:
+            # Graded by another worker or before a restart, or evicted from memory
+            original = self._read_disk(image_id)
+            if original is not None:
+                self.disk_hits += 1
+                self._insert((image_id,), original)
+        return original
+
+    def get(self, image_id: str, fmt: Optional[str] = None, quality: Optional[int] = None,
+            thumb: Optional[int] = None) -> Optional[StoredImage]:
+        """
+        The original (no options) or a re-encoded variant; None if the id is unknown or was evicted
+        """
+        original = self._original(image_id)
+        if original is None:
+            return None
+        fmt = (fmt or "").lower() or None
+        if fmt is None and not thumb:
+            return original
+        if fmt is None:
+            fmt = {"image/jpeg": "jpeg", "image/webp": "webp"}.get(original.media_type, "png")
+        if fmt not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        ext, media_type = IMAGE_FORMATS[fmt]
+        quality = max(1, min(100, quality or IMAGE_DEFAULT_QUALITY)) if ext != ".png" else None
+        thumb = max(16, thumb) if thumb else None
+
+        key = (image_id, ext, quality, thumb)
+        variant = self._lookup(key)
+        if variant is not None:
+            self.variant_hits += 1
+            return variant
+        self.variant_misses += 1
+
+        pixels = cv2.imdecode(np.frombuffer(original.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if pixels is None:
+            return None
+        if thumb:
+            height, width = pixels.shape[:2]
+            scale = thumb / max(height, width)
+            if scale < 1.0:
+                pixels = cv2.resize(pixels, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        params = []
+        if ext == ".jpg":
+            params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        elif ext == ".webp":
+            params = [int(cv2.IMWRITE_WEBP_QUALITY), quality]
+        ok, buf = cv2.imencode(ext, pixels, params)
+        if not ok:
+            return None
+        variant = StoredImage(buf.tobytes(), media_type)
+        self._insert(key, variant)
+        return variant
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "originals": sum(1 for k in self._items if len(k) == 1),
+                "size_mb": round(self._bytes / (1024 * 1024), 1),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "variant_hits": self.variant_hits,
+                "variant_misses": self.variant_misses,
+                "disk_hits": self.disk_hits,
+                "disk_dir": self.cache_dir,
+                "max_disk_mb": round(self.max_disk_bytes / (1024 * 1024), 1),
+            }
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Single "bytes=start-end" range -> inclusive (start, end). None means serve the whole body;
+    ValueError means the range cannot be satisfied (416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        first = int(start_s) if start_s else None
+        last = int(end_s) if end_s else None
+    except ValueError:
+        # Malformed ranges are ignored, as if no Range header was sent
+        return None
+    if first is None and last is None:
+        return None
+    if first is None:
+        # Suffix range: the last N bytes
+        if not last or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - last), size - 1
+    start, end = first, last if last is not None else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
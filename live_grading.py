@@ -0,0 +1,135 @@
+"""
+Live grading of camera snapshots
+Each room keeps a perceptual hash per problem region; a new frame only re-reads (TrOCR)
+the problems whose region changed since they were last graded
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from math_checker import OFFLINE_PROBLEM_WIDTH
+from roi_fixer import ROIBoxFixer
+
+# Hamming distance (of 64 bits) above which a problem region counts as changed
+LIVE_HASH_DISTANCE = int(os.getenv("MIILA_LIVE_HASH_DISTANCE", "6"))
+LIVE_MAX_ROOMS = int(os.getenv("MIILA_LIVE_MAX_ROOMS", "64"))
+
+
+def dhash(region: np.ndarray) -> int:
+    """
+    64-bit difference hash: brightness gradients of a 9x8 thumbnail, robust to noise and exposure
+    """
+    if region is None or region.size == 0:
+        return 0
+    gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if region.ndim == 3 else region
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def problem_regions(image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """
+    (x0, y0, x1, y1) per problem: printed problem, answer box and the working grid below it
+    """
+    height, width = image.shape[:2]
+    regions = []
+    for x, y, w, h in ROIBoxFixer().find_answer_locations_in(image):
+        regions.append((max(0, int(x - OFFLINE_PROBLEM_WIDTH * w)), max(0, y - h), min(width, x + w), min(height, y + 3 * h)))
+    return regions
+
+
+class LiveSession:
+    """Last graded state of one room"""
+
+    def __init__(self, room: str):
+        self.room = room
+        self.lock = threading.Lock()
+        # Hash of each problem region at the time that problem was last graded
+        self.hashes: List[int] = []
+        self.analysis: Optional[Dict[str, Any]] = None
+        self.frames = 0
+        self.skipped = 0
+        self.regraded = 0
+        self.updated_at = 0.0
+
+
+class LiveGrader:
+    """Per-room change detection in front of the offline (TrOCR) grader"""
+
+    def __init__(self, hash_distance: int = LIVE_HASH_DISTANCE, max_rooms: int = LIVE_MAX_ROOMS):
+        self.hash_distance = hash_distance
+        self.max_rooms = max(1, max_rooms)
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, LiveSession]" = OrderedDict()
+
+    def session(self, room: str) -> LiveSession:
+        with self._lock:
+            session = self._sessions.get(room)
+            if session is None:
+                session = LiveSession(room)
+                self._sessions[room] = session
+                while len(self._sessions) > self.max_rooms:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(room)
+            return session
+
+    def changed_problems(self, session: LiveSession, hashes: List[int]) -> List[int]:
+        previous = session.analysis.get("problems", []) if session.analysis else []
+        if len(session.hashes) != len(hashes) or len(previous) != len(hashes):
+            # First frame or the layout changed: grade everything
+            return list(range(len(hashes)))
+        return [i for i, (old, new) in enumerate(zip(session.hashes, hashes)) if hamming(old, new) > self.hash_distance]
+
+    def process(self, session: LiveSession, image: np.ndarray, checker: Any, reader: Any) -> Tuple[Optional[Dict[str, Any]], List[int]]:
+        """
+        Grade the changed problems of a frame. Returns (merged analysis, changed indices);
+        the analysis is None when nothing changed. Call with session.lock held.
+        """
+        session.frames += 1
+        hashes = [dhash(image[y0:y1, x0:x1]) for x0, y0, x1, y1 in problem_regions(image)]
+        changed = self.changed_problems(session, hashes)
+        if not changed:
+            return None, []
+
+        graded = checker.analyze_worksheet_offline(image, reader, indices=changed).get("problems", [])
+        if len(changed) == len(hashes):
+            problems = graded
+            new_hashes = hashes
+        else:
+            problems = list(session.analysis["problems"])
+            new_hashes = list(session.hashes)
+            for idx, problem in zip(changed, graded):
+                problems[idx] = problem
+                new_hashes[idx] = hashes[idx]
+        # Unchanged problems keep the hash they were graded at, so slow drift still triggers a re-read
+        session.hashes = new_hashes
+        session.analysis = {"problems": problems}
+        session.regraded += len(changed)
+        session.updated_at = time.time()
+        return session.analysis, changed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hash_distance": self.hash_distance,
+                "rooms": {
+                    room: {
+                        "frames": s.frames,
+                        "skipped": s.skipped,
+                        "regraded_problems": s.regraded,
+                        "problems": len(s.hashes),
+                        "updated_at": s.updated_at or None,
+                    }
+                    for room, s in self._sessions.items()
+                },
+            }
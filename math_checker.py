@@ -6,101 +6,805 @@ import numpy as np
 import openai
 import json
 import base64
-from typing import List, Dict, Any, Tuple
+import re
+import hashlib
+import os
+import threading
+import time
+import httpx
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Optional, Iterator
 from PIL import Image, ImageDraw
 from roi_fixer import ROIBoxFixer
+from vision_payload import VisionPayloadBuilder
 
-class SimpleMathChecker:
-    """Simple, clean math worksheet checker"""
-    
-    def __init__(self, openai_api_key: str):
-        self.client = openai.OpenAI(api_key=openai_api_key)
-    
-    def analyze_worksheet(self, image_path: str) -> Dict[str, Any]:
+# Bump whenever the analysis prompt or the rendering changes so cached results are not reused
+PROMPT_VERSION = "2"
+MODEL_NAME = "gpt-4o"
+
+# Offline (TrOCR) grading: readings below this confidence are re-read by GPT-4o
+OFFLINE_CONFIDENCE = float(os.getenv("MIILA_OFFLINE_CONFIDENCE", "0.6"))
+# Fraction of dark pixels below which an answer box counts as empty
+OFFLINE_EMPTY_INK_RATIO = 0.01
+# Fraction of blue-ink pixels in the grid below an answer that counts as "working shown"
+OFFLINE_STEPS_INK_RATIO = 0.005
+# The printed problem sits left of the answer line, about this many answer-box widths wide
+OFFLINE_PROBLEM_WIDTH = 1.3
+
+OFFLINE_TRANSCRIBE_PROMPT = """
+        Each image shows one problem from a German math worksheet: the printed problem and the
+        handwritten answer after the equals sign. Transcribe only, do not solve or judge.
+
+        Return only JSON with one entry per image, in the same order:
+        {"problems": [{"problem": "426 + 267 =", "handwritten": "693"}]}
+        Use "" for handwritten when nothing is written.
+         """
+
+RESULT_CACHE_DIR = os.getenv("MIILA_RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results"))
+RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("MIILA_RESULT_CACHE_ENTRIES", "64"))
+RESULT_CACHE_DISK_BYTES = int(os.getenv("MIILA_RESULT_CACHE_DISK_MB", "256")) * 1024 * 1024
+
+OPENAI_CLIENT_IDLE_SECONDS = float(os.getenv("MIILA_OPENAI_CLIENT_IDLE_SECONDS", "900"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("MIILA_OPENAI_MAX_CONNECTIONS", "32"))
+
+
+class OpenAIClientRegistry:
+    """Process-wide OpenAI clients keyed by a hash of the API key, sharing one keep-alive pool"""
+
+    def __init__(self, idle_timeout: float = OPENAI_CLIENT_IDLE_SECONDS,
+                 max_connections: int = OPENAI_MAX_CONNECTIONS):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max(1, max_connections)
+        self._clients: Dict[str, Tuple[openai.OpenAI, float]] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key_id(api_key: str) -> str:
+        # Never keep raw keys as dict keys
+        return hashlib.sha256(api_key.strip().encode()).hexdigest()
+
+    def _shared_http_client(self) -> httpx.Client:
+        # The OpenAI client sets auth per request, so one pool can serve every key
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=max(5.0, self.idle_timeout),
+                ),
+                timeout=httpx.Timeout(600.0, connect=5.0),
+            )
+        return self._http_client
+
+    def get(self, api_key: str) -> openai.OpenAI:
+        key_id = self._key_id(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key_id)
+            if entry is not None:
+                client = entry[0]
+            else:
+                client = openai.OpenAI(api_key=api_key.strip(), http_client=self._shared_http_client())
+            self._clients[key_id] = (client, now)
+            return client
+
+    def discard(self, api_key: str) -> None:
+        """Forget the client for a key (e.g. after it was rejected as invalid)"""
+        with self._lock:
+            self._clients.pop(self._key_id(api_key), None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+    def _evict_idle(self, now: float) -> None:
+        # Clients share the pool, so evicting just drops the reference
+        expired = [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_timeout]
+        for k in expired:
+            del self._clients[k]
+
+
+_client_registry = OpenAIClientRegistry()
+
+
+def get_openai_client(api_key: str) -> openai.OpenAI:
+    """Warm, pooled OpenAI client for this API key"""
+    return _client_registry.get(api_key)
+
+
+def get_client_registry() -> OpenAIClientRegistry:
+    return _client_registry
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache of graded worksheets keyed by image content"""
+
+    def __init__(self, cache_dir: Optional[str] = RESULT_CACHE_DIR,
+                 max_entries: int = RESULT_CACHE_MEMORY_ENTRIES,
+                 max_disk_bytes: int = RESULT_CACHE_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max(0, max_entries)
+        self.max_disk_bytes = max(0, max_disk_bytes)
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, prompt_version: str = PROMPT_VERSION, model: str = MODEL_NAME) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f"{digest}:{prompt_version}:{model}".encode()).hexdigest()
+
+    def _disk_path(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
         """
-        Analyze worksheet using GPT-4o Vision - simple and direct
+        Return the cached entry (analysis, summary, report, annotated image bytes) or None
         """
-        # Encode image
-        with open(image_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode()
-        
-        # Simple, clear prompt
-        prompt = """
-        Look at this German math worksheet. Analyze the 6 problems in "Rechne auf deinem Weg" section.
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_bytes": self._disk_usage(),
+                "max_disk_bytes": self.max_disk_bytes,
+            }
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        if self.max_entries == 0:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            data["image"] = base64.b64decode(data.get("image", ""))
+            # Touch so size-based eviction drops the least recently used files first
+            os.utime(path, None)
+            return data
+        except Exception:
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._disk_path(key)
+        if not path or self.max_disk_bytes == 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data = dict(entry)
+            data["image"] = base64.b64encode(entry.get("image") or b"").decode()
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except Exception as e:
+            print(f"Result cache write failed: {e}")
+
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._disk_files())
+
+    def _evict_disk(self) -> None:
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_disk_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_result_cache = ResultCache()
+
+
+def get_result_cache() -> ResultCache:
+    """Process-wide result cache shared by all SimpleMathChecker instances"""
+    return _result_cache
+
+
+# Transcription-only prompt: the arithmetic (correct answer, steps, status) is done locally
+# by ArithmeticEngine, which keeps the model output short and the grading exact
+ANALYSIS_PROMPT = """
+        Look at this German math worksheet. Find the 6 problems in the "Rechne auf deinem Weg" section.
+
+        Only transcribe what is on the page. Do NOT solve the problems or judge the answers.
 
         For each problem:
-        1. Find the math problem (like "426 + 267 =")
-        2. Look at the handwritten answer after the equals sign
-        3. Check if work is shown in the grid below (step-by-step calculation)
-        4. Calculate the correct answer
-        5. Determine status: 
-           - "perfect": correct answer + proper steps shown
-           - "correct_no_steps": correct answer but no/poor steps  
-           - "wrong": incorrect answer
-           - "empty": no answer written
-
-        6. Find the EXACT location of the handwritten answer (the underlined area after =)
-
-        Return JSON with these EXACT coordinates for the answer areas:
+        1. Copy the printed math problem exactly (like "426 + 267 =")
+        2. Copy the handwritten answer after the equals sign exactly as written ("" if nothing is written)
+        3. Copy any working written in the grid below into steps_shown (empty list if none)
+        4. Give the location of the handwritten answer (the underlined area after =)
+
+        Return only JSON in this shape:
         {
             "problems": [
                 {
                     "problem": "426 + 267 =",
-                    "handwritten": "693", 
-                    "correct_answer": "693",
-                    "status": "correct_no_steps",
+                    "handwritten": "693",
                     "steps_shown": ["6+7=13", "60+20=80"],
-                    "correct_steps": ["Add units: 6+7=13 (carry 1)", "Add tens: 2+6+1=9", "Add hundreds: 4+2=6", "Answer: 693"],
-                    "box_x": 0.20,
-                    "box_y": 0.36,
-                    "box_width": 0.08,
-                    "box_height": 0.025,
-                    "feedback": "Correct answer! Please show your working steps."
+                    "box_x": 0.24,
+                    "box_y": 0.31,
+                    "box_width": 0.06,
+                    "box_height": 0.03
                 }
             ]
         }
 
-        EXACT COORDINATES - Use these precise values:
-        Problem 1 (426 + 267 = 693): box_x: 0.24, box_y: 0.31
-        Problem 2 (383 + 459 = 732): box_x: 0.67, box_y: 0.31  
-        Problem 3 (617 + 126 = 743): box_x: 0.24, box_y: 0.52
-        Problem 4 (574 + 218 = 792): box_x: 0.67, box_y: 0.52
-        Problem 5 (345 + 238 = 573): box_x: 0.24, box_y: 0.73
-        Problem 6 (459 + 337 = 796): box_x: 0.67, box_y: 0.73
-        
+        Answer locations (fractions of image width/height), in reading order:
+        Problem 1: box_x: 0.24, box_y: 0.31
+        Problem 2: box_x: 0.67, box_y: 0.31
+        Problem 3: box_x: 0.24, box_y: 0.52
+        Problem 4: box_x: 0.67, box_y: 0.52
+        Problem 5: box_x: 0.24, box_y: 0.73
+        Problem 6: box_x: 0.67, box_y: 0.73
+
         Use box_width: 0.06, box_height: 0.03 for all problems.
          """
-        
+
+
+_PLACE_NAMES = ["units", "tens", "hundreds", "thousands", "ten-thousands", "hundred-thousands", "millions"]
+
+
+class ArithmeticEngine:
+    """Deterministic solver for written-arithmetic problems like "426 + 267 =" """
+
+    _PROBLEM = re.compile(r"^\s*(\d[\d.\s]*?)\s*([+\-−–×x*·:÷/])\s*(\d[\d.\s]*?)\s*=?\s*$", re.IGNORECASE)
+    _OPS = {"+": "+", "-": "-", "−": "-", "–": "-", "×": "*", "x": "*", "X": "*", "*": "*", "·": "*",
+            ":": "/", "÷": "/", "/": "/"}
+
+    @staticmethod
+    def _place(i: int) -> str:
+        return _PLACE_NAMES[i] if i < len(_PLACE_NAMES) else f"10^{i} place"
+
+    @staticmethod
+    def _to_int(text: str) -> int:
+        # German worksheets may write thousands separators as dots or spaces
+        return int(re.sub(r"[.\s]", "", text))
+
+    def parse(self, problem: str) -> Optional[Tuple[int, str, int]]:
+        """
+        Parse "a op b =" into (a, op, b) with op in + - * /, or None if it is not simple arithmetic
+        """
+        match = self._PROBLEM.match(problem or "")
+        if not match:
+            return None
+        return self._to_int(match.group(1)), self._OPS[match.group(2)], self._to_int(match.group(3))
+
+    def solve(self, a: int, op: str, b: int) -> Tuple[str, List[str]]:
+        """
+        Return (answer, column-method steps)
+        """
+        if op == "+":
+            return self._add(a, b)
+        if op == "-":
+            return self._subtract(a, b)
+        if op == "*":
+            return self._multiply(a, b)
+        return self._divide(a, b)
+
+    def _add(self, a: int, b: int) -> Tuple[str, List[str]]:
+        da, db = str(a)[::-1], str(b)[::-1]
+        steps, carry = [], 0
+        for i in range(max(len(da), len(db))):
+            x = int(da[i]) if i < len(da) else 0
+            y = int(db[i]) if i < len(db) else 0
+            total = x + y + carry
+            expr = f"{x}+{y}" + (f"+{carry}" if carry else "")
+            carry = total // 10
+            note = f" (carry {carry})" if carry else ""
+            steps.append(f"Add {self._place(i)}: {expr}={total}{note}")
+        if carry:
+            steps.append(f"Write the carried {carry} in the {self._place(max(len(da), len(db)))}")
+        answer = str(a + b)
+        steps.append(f"Answer: {answer}")
+        return answer, steps
+
+    def _subtract(self, a: int, b: int) -> Tuple[str, List[str]]:
+        if a < b:
+            answer, steps = self._subtract(b, a)
+            answer = f"-{answer}"
+            return answer, [f"{b} is larger than {a}, so work out {b} - {a} and make it negative"] + steps[:-1] + [f"Answer: {answer}"]
+        da, db = str(a)[::-1], str(b)[::-1]
+        steps, borrow = [], 0
+        for i in range(len(da)):
+            x = int(da[i]) - borrow
+            y = int(db[i]) if i < len(db) else 0
+            if i >= len(db) and x >= 0:
+                if x or i < len(da) - 1:
+                    steps.append(f"Bring down {self._place(i)}: {x}")
+                borrow = 0
+                continue
+            if x < y:
+                steps.append(f"Subtract {self._place(i)}: {x + 10}-{y}={x + 10 - y} (borrow 1 from the {self._place(i + 1)})")
+                borrow = 1
+            else:
+                steps.append(f"Subtract {self._place(i)}: {x}-{y}={x - y}")
+                borrow = 0
+        answer = str(a - b)
+        steps.append(f"Answer: {answer}")
+        return answer, steps
+
+    def _multiply(self, a: int, b: int) -> Tuple[str, List[str]]:
+        db = str(b)[::-1]
+        answer = str(a * b)
+        if len(db) == 1:
+            da = str(a)[::-1]
+            steps, carry = [], 0
+            for i, d in enumerate(da):
+                total = int(d) * b + carry
+                expr = f"{d}×{b}" + (f"+{carry}" if carry else "")
+                carry = total // 10
+                note = f" (write {total % 10}, carry {carry})" if carry else ""
+                steps.append(f"Multiply {self._place(i)}: {expr}={total}{note}")
+            if carry:
+                steps.append(f"Write the carried {carry} in the {self._place(len(da))}")
+            steps.append(f"Answer: {answer}")
+            return answer, steps
+        steps, partials = [], []
+        for i, d in enumerate(db):
+            factor = int(d) * 10 ** i
+            partials.append(a * factor)
+            steps.append(f"Multiply {a}×{factor}={a * factor}")
+        steps.append(f"Add partial products: {' + '.join(str(p) for p in partials)} = {answer}")
+        steps.append(f"Answer: {answer}")
+        return answer, steps
+
+    def _divide(self, a: int, b: int) -> Tuple[str, List[str]]:
+        if b == 0:
+            return "", ["Division by zero is not possible"]
+        steps, remainder, started = [], 0, False
+        for d in str(a):
+            current = remainder * 10 + int(d)
+            q = current // b
+            remainder = current - q * b
+            if not started and q == 0 and current < b:
+                continue
+            started = True
+            steps.append(f"Divide {current}÷{b}={q}, {q}×{b}={q * b}, remainder {remainder}")
+        quotient, rest = divmod(a, b)
+        answer = str(quotient) if rest == 0 else f"{quotient} R {rest}"
+        steps.append(f"Answer: {answer}")
+        return answer, steps
+
+    @staticmethod
+    def normalize_answer(text: str) -> str:
+        """
+        Canonical form for comparing answers: digits, optional leading minus, "R" for remainders
+        """
+        text = (text or "").strip()
+        text = re.sub(r"(?i)\s*(rest|r)\s*", " R ", text)
+        parts = [re.sub(r"[^\d\-]", "", p) for p in text.split(" R ")]
+        parts = [p.lstrip("0") or ("0" if p else "") for p in parts]
+        return " R ".join(p for p in parts if p)
+
+    def grade_problem(self, problem: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Fill in correct_answer, correct_steps, status and feedback from the transcribed problem
+        """
+        parsed = self.parse(problem.get("problem", ""))
+        handwritten = str(problem.get("handwritten") or "").strip()
+        if parsed is None:
+            # Not simple arithmetic: keep a status the model provided, otherwise leave it for a
+            # teacher to check (neutral "empty") rather than marking a possibly correct answer wrong
+            if not handwritten:
+                problem["status"] = "empty"
+            elif "status" not in problem:
+                problem["status"] = "empty"
+                problem.setdefault("feedback", "Could not check this one automatically - please review it.")
+            return problem
+
+        answer, steps = self.solve(*parsed)
+        problem["correct_answer"] = answer
+        problem["correct_steps"] = steps
+        if not handwritten:
+            problem["status"] = "empty"
+            problem["feedback"] = "No answer yet - give it a try!"
+        elif self.normalize_answer(handwritten) == self.normalize_answer(answer):
+            if problem.get("steps_shown"):
+                problem["status"] = "perfect"
+                problem["feedback"] = "Perfect! Correct with steps."
+            else:
+                problem["status"] = "correct_no_steps"
+                problem["feedback"] = "Correct answer! Please show your working steps."
+        else:
+            problem["status"] = "wrong"
+            problem["feedback"] = f"Not quite - the answer is {answer}."
+        return problem
+
+    def grade_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        for problem in analysis.get("problems", []) if isinstance(analysis, dict) else []:
+            if isinstance(problem, dict):
+                self.grade_problem(problem)
+        return analysis
+
+
+class ProblemStreamParser:
+    """Incrementally pull problem objects out of a streamed {"problems": [...]} completion"""
+
+    _ARRAY_START = re.compile(r'"problems"\s*:\s*\[')
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        """True once the closing ] of the problems array has been read"""
+        return self._done
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Append a chunk of model output; return the problem objects completed by it
+        """
+        self.text += chunk
+        completed: List[Dict[str, Any]] = []
+        if self._done:
+            return completed
+        if not self._in_array:
+            match = self._ARRAY_START.search(self.text)
+            if not match:
+                return completed
+            self._in_array = True
+            self._pos = match.end()
+
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{':
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif c == '}':
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        completed.append(json.loads(text[self._obj_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._obj_start = None
+            elif c == ']' and self._depth == 0:
+                self._done = True
+                i += 1
+                break
+            i += 1
+        self._pos = i
+        return completed
+
+
+class SimpleMathChecker:
+    """Simple, clean math worksheet checker"""
+    
+    def __init__(self, openai_api_key: Optional[str], model: str = MODEL_NAME, cache: Optional[ResultCache] = None,
+                 payload_builder: Optional[VisionPayloadBuilder] = None):
+        # No key is fine for offline grading; GPT-4o escalation is then skipped
+        self.client = get_openai_client(openai_api_key) if openai_api_key else None
+        self.model = model
+        self.arithmetic = ArithmeticEngine()
+        self.cache = cache if cache is not None else get_result_cache()
+        self.payload = payload_builder if payload_builder is not None else VisionPayloadBuilder()
+        self.last_payload_stats: Dict[str, Any] = {}
+        # Set by analyze_worksheet_stream: the model finished normally and the problem list is whole
+        self.last_stream_complete = False
+    
+    def analyze_worksheet(self, image_path: str) -> Dict[str, Any]:
+        """
+        Analyze worksheet using GPT-4o Vision - simple and direct
+        """
+        with open(image_path, "rb") as f:
+            return self.analyze_worksheet_bytes(f.read())
+    
+    def analyze_worksheet_bytes(self, image_bytes: bytes, image: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        Same as analyze_worksheet, on the encoded image bytes (pass the decoded image if already available)
+        """
         try:
+            if image is None:
+                image = self._decode(image_bytes)
             response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-                        ]
-                    }
-                ],
+                model=self.model,
+                messages=self._analysis_messages(image_bytes, image),
                 max_tokens=2000,
                 temperature=0
             )
+            self._record_usage(getattr(response, "usage", None))
             
-            # Parse response
-            content = response.choices[0].message.content
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            
-            if start != -1 and end != 0:
-                return json.loads(content[start:end])
-            else:
-                return {"problems": []}
+            # Parse response and grade the transcription locally
+            analysis = self._parse_analysis(response.choices[0].message.content)
+            locations = self._answer_locations(image)
+            for idx, problem in enumerate(analysis.get("problems", [])):
+                self._place_problem(problem, idx, locations, image)
+            return self.arithmetic.grade_analysis(analysis)
                 
         except Exception as e:
             print(f"Error: {e}")
             return {"problems": []}
     
+    def analyze_worksheet_stream(self, image_bytes: bytes, image: Optional[np.ndarray] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant: yield each problem object as soon as GPT-4o closes it.
+        last_stream_complete tells afterwards whether the reply ended normally (finish_reason
+        "stop" and a closed problems array); a dropped or truncated stream leaves it False.
+        """
+        self.last_stream_complete = False
+        parser = ProblemStreamParser()
+        emitted = 0
+        finish_reason = None
+        locations: List[Tuple[int, int, int, int]] = []
+        try:
+            if image is None:
+                image = self._decode(image_bytes)
+            locations = self._answer_locations(image)
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=self._analysis_messages(image_bytes, image),
+                max_tokens=2000,
+                temperature=0,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    self._record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                for problem in parser.feed(delta):
+                    self._place_problem(problem, emitted, locations, image)
+                    emitted += 1
+                    yield self.arithmetic.grade_problem(problem)
+        except Exception as e:
+            print(f"Error: {e}")
+            finish_reason = None
+        
+        # Model did not follow the {"problems": [...]} shape incrementally; fall back to a full parse
+        if emitted == 0 and parser.text and not parser.done:
+            try:
+                problems = [p for p in self._parse_analysis(parser.text).get("problems", []) if isinstance(p, dict)]
+                self.last_stream_complete = finish_reason == "stop"
+            except Exception as e:
+                # Same as analyze_worksheet_bytes: an unreadable reply grades as no problems
+                print(f"Error: {e}")
+                problems = []
+            for idx, problem in enumerate(problems):
+                self._place_problem(problem, idx, locations, image)
+                yield self.arithmetic.grade_problem(problem)
+        elif parser.done:
+            self.last_stream_complete = finish_reason == "stop"
+    
+    def _analysis_messages(self, image_bytes: bytes, image: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        image_parts, stats = self.payload.build(image_bytes, image)
+        self.last_payload_stats = stats
+        print(f"Vision payload: {stats['images']} image(s), {stats['original_bytes']} -> {stats['sent_bytes']} bytes, "
+              f"~{stats['original_tokens_est']} -> ~{stats['sent_tokens_est']} image tokens")
+        text = ANALYSIS_PROMPT
+        if self.payload.crop == "rois":
+            text += "\n        The worksheet is sent as one cropped image per problem, in reading order (Problem 1 first).\n"
+        elif self.payload.crop == "section":
+            text += "\n        The image is cropped to the exercise section.\n"
+        return [
+            {
+                "role": "user", 
+                "content": [{"type": "text", "text": text}] + image_parts
+            }
+        ]
+    
+    def _record_usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.last_payload_stats["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        self.last_payload_stats["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        print(f"Token usage: prompt={self.last_payload_stats['prompt_tokens']} completion={self.last_payload_stats['completion_tokens']}")
+    
+    def _answer_locations(self, image: Optional[np.ndarray]) -> List[Tuple[int, int, int, int]]:
+        # Model coordinates are meaningless for cropped payloads; use the known answer areas instead
+        if image is None or self.payload.crop == "full":
+            return []
+        return ROIBoxFixer().find_answer_locations_in(image)
+    
+    @staticmethod
+    def _place_problem(problem: Dict[str, Any], index: int, locations: List[Tuple[int, int, int, int]], image: Optional[np.ndarray]) -> None:
+        if image is None or index >= len(locations) or not isinstance(problem, dict):
+            return
+        height, width = image.shape[:2]
+        x, y, w, h = locations[index]
+        problem["box_x"] = x / max(1, width)
+        problem["box_y"] = y / max(1, height)
+        problem["box_width"] = w / max(1, width)
+        problem["box_height"] = h / max(1, height)
+    
+    def analyze_worksheet_offline(self, image: np.ndarray, reader: Any,
+                                  confidence_threshold: float = OFFLINE_CONFIDENCE,
+                                  indices: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Read the six problems locally with a batched TrOCR reader (see trocr_reader.TrOCRReader).
+        Only crops read with low confidence are escalated to GPT-4o, and only if a client is configured.
+        With indices, only those problems are read and returned (in that order).
+        """
+        height, width = image.shape[:2]
+        locations = ROIBoxFixer().find_answer_locations_in(image)
+        if indices is not None:
+            locations = [locations[i] for i in indices if 0 <= i < len(locations)]
+        answer_crops, problem_crops, cell_regions = [], [], []
+        for x, y, w, h in locations:
+            px = max(0, int(x - OFFLINE_PROBLEM_WIDTH * w))
+            answer_crops.append(image[y:y + h, x:x + w])
+            problem_crops.append(image[y:y + h, px:x])
+            cell_regions.append((px, max(0, y - h), min(width, x + w), min(height, y + 3 * h)))
+
+        # Blank answer boxes are skipped; TrOCR hallucinates on empty crops
+        inked = [self._ink_ratio(c) >= OFFLINE_EMPTY_INK_RATIO for c in answer_crops]
+        batch = problem_crops + [c for c, has_ink in zip(answer_crops, inked) if has_ink]
+        readings = reader.read_batch(batch)
+        problem_readings = readings[:len(problem_crops)]
+        answer_iter = iter(readings[len(problem_crops):])
+
+        problems, uncertain = [], []
+        for idx, (x, y, w, h) in enumerate(locations):
+            problem_text, problem_conf = problem_readings[idx]
+            answer_text, answer_conf = next(answer_iter) if inked[idx] else ("", 1.0)
+            problem = {
+                "problem": problem_text if problem_text.rstrip().endswith("=") else f"{problem_text} =",
+                "handwritten": re.sub(r"[^\d\-]", "", answer_text),
+                "steps_shown": ["(working shown in grid)"] if self._steps_ink_ratio(image, (x, y, w, h)) >= OFFLINE_STEPS_INK_RATIO else [],
+                "box_x": x / max(1, width),
+                "box_y": y / max(1, height),
+                "box_width": w / max(1, width),
+                "box_height": h / max(1, height),
+                "source": "trocr",
+                "confidence": round(min(problem_conf, answer_conf), 3),
+            }
+            if (self.arithmetic.parse(problem["problem"]) is None
+                    or problem["confidence"] < confidence_threshold
+                    or (inked[idx] and not problem["handwritten"])):
+                uncertain.append(idx)
+            problems.append(problem)
+
+        if uncertain and self.client is not None:
+            print(f"Escalating {len(uncertain)} low-confidence problem(s) to {self.model}")
+            crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in (cell_regions[i] for i in uncertain)]
+            for idx, read in zip(uncertain, self._transcribe_crops(crops)):
+                problems[idx]["problem"] = read.get("problem", problems[idx]["problem"])
+                problems[idx]["handwritten"] = str(read.get("handwritten") or "")
+                problems[idx]["source"] = self.model
+        return self.arithmetic.grade_analysis({"problems": problems})
+    
+    def _transcribe_crops(self, crops: List[np.ndarray]) -> List[Dict[str, Any]]:
+        content: List[Dict[str, Any]] = [{"type": "text", "text": OFFLINE_TRANSCRIBE_PROMPT}]
+        for crop in crops:
+            ok, buf = cv2.imencode(".jpg", crop, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+            if ok:
+                data = base64.b64encode(buf.tobytes()).decode()
+                content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}", "detail": "low"}})
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=400,
+                temperature=0
+            )
+            self._record_usage(getattr(response, "usage", None))
+            return self._parse_analysis(response.choices[0].message.content).get("problems", [])
+        except Exception as e:
+            print(f"Error: {e}")
+            return []
+    
+    @staticmethod
+    def _ink_ratio(crop: np.ndarray) -> float:
+        if crop is None or crop.size == 0:
+            return 0.0
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return float(np.count_nonzero(gray < 110)) / gray.size
+    
+    @staticmethod
+    def _steps_ink_ratio(image: np.ndarray, box: Tuple[int, int, int, int]) -> float:
+        # Students write in blue ink; the printed grid is grey, so only count blue strokes
+        x, y, w, h = box
+        height, width = image.shape[:2]
+        x0 = max(0, int(x - OFFLINE_PROBLEM_WIDTH * w))
+        grid = image[min(height, y + h):min(height, y + 4 * h), x0:min(width, x + w)]
+        if grid.size == 0:
+            return 0.0
+        hsv = cv2.cvtColor(grid, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (85, 60, 40), (135, 255, 255))
+        return float(cv2.countNonZero(mask)) / mask.size
+    
+    @staticmethod
+    def _parse_analysis(content: Optional[str]) -> Dict[str, Any]:
+        content = content or ""
+        start = content.find('{')
+        end = content.rfind('}') + 1
+        
+        if start != -1 and end != 0:
+            return json.loads(content[start:end])
+        else:
+            return {"problems": []}
+    
     def draw_feedback(self, image_path: str, analysis: Dict[str, Any]) -> str:
         """
         Draw simple colored boxes on the worksheet
@@ -109,7 +813,19 @@ class SimpleMathChecker:
         image = cv2.imread(image_path)
         if image is None:
             return image_path
-            
+        
+        image = self.draw_feedback_image(image, analysis)
+        
+        # Save result
+        output_path = image_path.replace('.', '_checked.')
+        cv2.imwrite(output_path, image)
+        return output_path
+    
+    def draw_feedback_image(self, image: np.ndarray, analysis: Dict[str, Any]) -> np.ndarray:
+        """
+        Draw the feedback boxes onto a copy of a decoded BGR image
+        """
+        image = image.copy()
         height, width = image.shape[:2]
         
         # Enhanced color system
@@ -155,10 +871,7 @@ class SimpleMathChecker:
             if feedback and len(feedback) < 30:  # Short feedback only
                 cv2.putText(image, feedback[:20], (x, y+h+15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
         
-        # Save result
-        output_path = image_path.replace('.', '_checked.')
-        cv2.imwrite(output_path, image)
-        return output_path
+        return image
     
     def generate_report(self, analysis: Dict[str, Any]) -> str:
         """
@@ -204,13 +917,120 @@ class SimpleMathChecker:
         
         return report
     
+    @staticmethod
+    def summarize(analysis: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Count problems per status
+        """
+        problems = analysis.get("problems", [])
+        return {
+            "total": len(problems),
+            "perfect": sum(1 for p in problems if p.get("status") == "perfect"),
+            "correct_no_steps": sum(1 for p in problems if p.get("status") == "correct_no_steps"),
+            "wrong": sum(1 for p in problems if p.get("status") == "wrong"),
+            "empty": sum(1 for p in problems if p.get("status") == "empty")
+        }
+    
+    def render_feedback(self, image: np.ndarray, analysis: Dict[str, Any]) -> np.ndarray:
+        """
+        Produce the final annotated image: each problem's status colour at its answer location.
+        Draws onto the decoded original, which callers no longer need.
+        """
+        return ROIBoxFixer().render_status_boxes(image, analysis.get("problems", []))
+    
     def check_worksheet(self, image_path: str) -> Tuple[str, str, Dict[str, Any], Dict[str, Any]]:
         """
         Complete workflow: analyze, draw feedback, generate report
         """
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        ext = os.path.splitext(image_path)[1] or ".png"
+        annotated, report, summary, analysis = self.check_worksheet_bytes(image_bytes, ext)
+        
+        output_path = image_path.replace('.', '_checked_fixed.')
+        with open(output_path, "wb") as f:
+            f.write(annotated)
+        return output_path, report, summary, analysis
+    
+    def check_worksheet_bytes(self, image_bytes: bytes, ext: str = ".png") -> Tuple[bytes, str, Dict[str, Any], Dict[str, Any]]:
+        """
+        In-memory workflow: decode once, analyze, render, fix boxes and encode the result to bytes.
+        No temporary files are written.
+        """
+        # Content-addressed cache: identical pixels + prompt + model never hit the API twice
+        cache_key = self._cache_key(image_bytes)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print("Using cached result")
+            return cached["image"], cached["report"], cached["summary"], cached["analysis"]
+
+        image = self._decode(image_bytes)
+
         print("Analyzing worksheet...")
-        analysis = self.analyze_worksheet(image_path)
+        analysis = self.analyze_worksheet_bytes(image_bytes, image)
+        return self._finish_grading(image, ext, analysis, cache_key)
+    
+    def check_worksheet_stream(self, image_bytes: bytes, ext: str = ".png") -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming workflow: yields ("problem", problem_dict) as each problem is read, then
+        ("result", (annotated_bytes, report, summary, analysis)) once rendering is done.
+        If the stream broke off, ("error", {"detail": ...}) replaces the result and nothing is cached.
+        """
+        cache_key = self._cache_key(image_bytes)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print("Using cached result")
+            for problem in cached["analysis"].get("problems", []):
+                yield "problem", problem
+            yield "result", (cached["image"], cached["report"], cached["summary"], cached["analysis"])
+            return
 
+        image = self._decode(image_bytes)
+
+        print("Analyzing worksheet (streaming)...")
+        problems = []
+        for problem in self.analyze_worksheet_stream(image_bytes, image):
+            problems.append(problem)
+            yield "problem", problem
+        if not self.last_stream_complete:
+            # A partial list must not land in the cache /analyze-worksheet reads from
+            yield "error", {"detail": f"Analysis stream ended early after {len(problems)} problem(s), please retry"}
+            return
+        yield "result", self._finish_grading(image, ext, {"problems": problems}, cache_key)
+    
+    def check_worksheet_offline(self, image_bytes: bytes, reader: Any, ext: str = ".png",
+                                confidence_threshold: float = OFFLINE_CONFIDENCE) -> Tuple[bytes, str, Dict[str, Any], Dict[str, Any]]:
+        """
+        Same as check_worksheet_bytes, but read with TrOCR on CPU and escalate only uncertain crops
+        """
+        # Results read without a client had no GPT-4o escalation; keep them apart from escalated ones
+        escalation = self.model if self.client is not None else "none"
+        cache_key = self._cache_key(image_bytes, f"offline:{confidence_threshold}:{escalation}")
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print("Using cached result")
+            return cached["image"], cached["report"], cached["summary"], cached["analysis"]
+
+        image = self._decode(image_bytes)
+
+        print("Reading worksheet offline...")
+        analysis = self.analyze_worksheet_offline(image, reader, confidence_threshold)
+        return self._finish_grading(image, ext, analysis, cache_key)
+    
+    def _cache_key(self, image_bytes: bytes, mode: str = "vision") -> str:
+        return ResultCache.make_key(image_bytes, f"{PROMPT_VERSION}:{mode}:{self.payload.signature()}", self.model)
+    
+    @staticmethod
+    def _decode(image_bytes: bytes) -> np.ndarray:
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode worksheet image")
+        return image
+    
+    def _finish_grading(self, image: np.ndarray, ext: str, analysis: Dict[str, Any], cache_key: str) -> Tuple[bytes, str, Dict[str, Any], Dict[str, Any]]:
+        """
+        Render, report and encode a finished analysis; cache it if it came from the model
+        """
         # Fallback: if the model returned nothing, create 6 placeholders at known locations
         try:
             problems = analysis.get("problems", []) if isinstance(analysis, dict) else []
@@ -218,11 +1038,11 @@ class SimpleMathChecker:
             problems = []
             analysis = {"problems": problems}
 
+        cacheable = bool(problems)
         if not problems:
-            image = cv2.imread(image_path)
-            height, width = image.shape[:2] if image is not None else (1, 1)
+            height, width = image.shape[:2]
             fixer = ROIBoxFixer()
-            boxes = fixer.find_answer_locations(image_path)
+            boxes = fixer.find_answer_locations_in(image)
             placeholder = []
             for idx, (x, y, w, h) in enumerate(boxes, start=1):
                 placeholder.append({
@@ -241,32 +1061,25 @@ class SimpleMathChecker:
             analysis = {"problems": placeholder}
         
         print("Drawing feedback...")
-        annotated_path = self.draw_feedback(image_path, analysis)
+        annotated = self.render_feedback(image, analysis)
         
         print("Generating report...")
         report = self.generate_report(analysis)
         
         # Enhanced summary stats
-        problems = analysis.get("problems", [])
-        perfect = sum(1 for p in problems if p.get("status") == "perfect")
-        correct_no_steps = sum(1 for p in problems if p.get("status") == "correct_no_steps")
-        wrong = sum(1 for p in problems if p.get("status") == "wrong")
-        empty = sum(1 for p in problems if p.get("status") == "empty")
-        
-        summary = {
-            "total": len(problems),
-            "perfect": perfect,
-            "correct_no_steps": correct_no_steps,
-            "wrong": wrong,
-            "empty": empty
-        }
-        
-        # Fix box positions using ROI detection
-        try:
-            from roi_fixer import fix_worksheet_boxes
-            fixed_path = fix_worksheet_boxes(annotated_path)
-            print(f"Box positions fixed! Check: {fixed_path}")
-            return fixed_path, report, summary, analysis
-        except Exception as e:
-            print(f"Box fixing failed: {e}")
-            return annotated_path, report, summary, analysis
+        summary = self.summarize(analysis)
+
+        ok, encoded = cv2.imencode(ext, annotated)
+        if not ok:
+            raise ValueError(f"Could not encode annotated image as {ext}")
+        image_out = encoded.tobytes()
+
+        # Only cache real model output; placeholders after an API failure must be retried
+        if cacheable:
+            self.cache.put(cache_key, {
+                "analysis": analysis,
+                "summary": summary,
+                "report": report,
+                "image": image_out,
+            })
+        return image_out, report, summary, analysis
@@ -0,0 +1,162 @@
+"""
+Resident model manager
+Loads OCR models on demand, unloads them after an idle TTL or when a memory budget is exceeded
+"""
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MIILA_MODEL_MEMORY_MB", "0"))   # 0 = unlimited
+MODEL_IDLE_TTL_SECONDS = float(os.getenv("MIILA_MODEL_IDLE_TTL_SECONDS", "1800"))  # 0 = never
+MODEL_REAPER_INTERVAL_SECONDS = 30.0
+
+
+def torch_module_bytes(*modules: Any) -> int:
+    """
+    Parameter + buffer bytes of torch modules (None entries are skipped)
+    """
+    total = 0
+    for module in modules:
+        if module is None or not hasattr(module, "parameters"):
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelManager:
+    """Named lazily-loaded models with idle eviction, a memory budget and load/evict counters"""
+
+    def __init__(self, memory_budget_mb: int = MODEL_MEMORY_BUDGET_MB, idle_ttl: float = MODEL_IDLE_TTL_SECONDS):
+        self.memory_budget = max(0, memory_budget_mb) * 1024 * 1024
+        self.idle_ttl = max(0.0, idle_ttl)
+        self._lock = threading.RLock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register(self, name: str, loader: Callable[[], Any], sizer: Optional[Callable[[Any], int]] = None) -> None:
+        """
+        loader returns the model object (or None if it cannot be loaded); sizer estimates its bytes
+        """
+        with self._lock:
+            self._models[name] = {
+                "loader": loader, "sizer": sizer, "value": None, "failed": False, "load_lock": threading.Lock(),
+                "bytes": 0, "last_used": 0.0, "loads": 0, "evictions": 0, "load_seconds": None,
+            }
+
+    def get(self, name: str) -> Any:
+        """
+        Return the resident model, loading it first if needed. Load failures are remembered.
+        """
+        with self._lock:
+            entry = self._models[name]
+            entry["last_used"] = time.monotonic()
+            if entry["value"] is not None or entry["failed"]:
+                return entry["value"]
+        # Per-model load lock: concurrent first requests load once, other models stay available
+        with entry["load_lock"]:
+            with self._lock:
+                if entry["value"] is not None or entry["failed"]:
+                    return entry["value"]
+            start = time.perf_counter()
+            try:
+                value = entry["loader"]()
+            except Exception as e:
+                print(f"Model {name} failed to load: {e}")
+                value = None
+            size = 0
+            if value is not None and entry["sizer"]:
+                try:
+                    size = int(entry["sizer"](value))
+                except Exception:
+                    size = 0
+            with self._lock:
+                entry["load_seconds"] = round(time.perf_counter() - start, 3)
+                if value is None:
+                    entry["failed"] = True
+                    return None
+                entry["value"] = value
+                entry["bytes"] = size
+                entry["loads"] += 1
+                entry["last_used"] = time.monotonic()
+            self._enforce_budget(keep=name)
+            return value
+
+    def is_resident(self, name: str) -> bool:
+        with self._lock:
+            return self._models.get(name, {}).get("value") is not None
+
+    def evict(self, name: str) -> bool:
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None or entry["value"] is None:
+                return False
+            # Requests still holding the object keep it alive until they finish
+            entry["value"] = None
+            entry["bytes"] = 0
+            entry["evictions"] += 1
+        gc.collect()
+        print(f"Model {name} unloaded")
+        return True
+
+    def evict_idle(self) -> None:
+        if not self.idle_ttl:
+            return
+        now = time.monotonic()
+        with self._lock:
+            idle = [n for n, e in self._models.items() if e["value"] is not None and now - e["last_used"] > self.idle_ttl]
+        for name in idle:
+            self.evict(name)
+
+    def _enforce_budget(self, keep: str) -> None:
+        if not self.memory_budget:
+            return
+        while self.resident_bytes() > self.memory_budget:
+            with self._lock:
+                victims = sorted((e["last_used"], n) for n, e in self._models.items() if e["value"] is not None and n != keep)
+            if not victims:
+                break
+            self.evict(victims[0][1])
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(e["bytes"] for e in self._models.values() if e["value"] is not None)
+
+    def start_reaper(self, interval: float = MODEL_REAPER_INTERVAL_SECONDS) -> None:
+        if self._reaper is not None or not self.idle_ttl:
+            return
+
+        def _run():
+            while not self._stop.wait(interval):
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=_run, name="miila-model-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                name: {
+                    "resident": e["value"] is not None,
+                    "failed": e["failed"],
+                    "resident_mb": round(e["bytes"] / (1024 * 1024), 1),
+                    "loads": e["loads"],
+                    "evictions": e["evictions"],
+                    "load_seconds": e["load_seconds"],
+                    "idle_seconds": round(now - e["last_used"], 1) if e["last_used"] else None,
+                }
+                for name, e in self._models.items()
+            }
+            return {
+                "resident_mb": round(self.resident_bytes() / (1024 * 1024), 1),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 1),
+                "idle_ttl_seconds": self.idle_ttl,
+                "models": models,
+            }
@@ -0,0 +1,134 @@
+"""
+Confidence-driven OCR cascade
+Runs several OCR engines concurrently and returns as soon as one is confident enough.
+Python threads cannot be interrupted, so losing engines stop cooperatively: each one gets a
+`cancelled()` callable and checks it between its stages (model load, detection, recognition).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+OCR_CONFIDENCE = float(os.getenv("MIILA_OCR_CONFIDENCE", "0.8"))
+# One cascade occupies one worker per engine until its losers reach their next cancel check,
+# so size this as engines x concurrent OCR requests (default: one request at a time)
+OCR_WORKERS = int(os.getenv("MIILA_OCR_WORKERS", "3"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("MIILA_OCR_TIMEOUT_SECONDS", "60"))
+
+# An engine takes the original BGR image, its preprocessed (binarized) version and a
+# cancelled() check, and returns (text, confidence in [0, 1]); once cancelled() is True
+# the result is discarded, so return ("", 0.0) at the next stage boundary
+Engine = Callable[[Any, Any, Callable[[], bool]], Tuple[str, float]]
+
+
+class OCRCascade:
+    """Concurrent OCR engines with early exit and per-engine latency / win-rate bookkeeping"""
+
+    def __init__(self, threshold: float = OCR_CONFIDENCE, workers: int = OCR_WORKERS,
+                 timeout: float = OCR_TIMEOUT_SECONDS):
+        self.threshold = threshold
+        self.timeout = timeout
+        self._engines: List[Tuple[str, Engine, float]] = []
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="miila-ocr")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self.runs = 0
+        self.early_exits = 0
+        # Engines still running after their cascade finished / never started because of it
+        self.abandoned = 0
+        self.skipped = 0
+
+    def register(self, name: str, engine: Engine, bonus: float = 0.0) -> None:
+        """
+        Add an engine; bonus is added to its heuristic score when no engine is confident
+        """
+        self._engines.append((name, engine, bonus))
+        self._stats.setdefault(name, {"calls": 0, "errors": 0, "wins": 0, "total_seconds": 0.0})
+
+    def _timed(self, name: str, engine: Engine, image: Any, prep: Any, done: threading.Event) -> Tuple[str, float]:
+        if done.is_set():
+            # Queued behind other work and the cascade already has its answer
+            with self._lock:
+                self.skipped += 1
+            return "", 0.0
+        start = time.perf_counter()
+        try:
+            return engine(image, prep, done.is_set)
+        except Exception:
+            with self._lock:
+                self._stats[name]["errors"] += 1
+            return "", 0.0
+        finally:
+            with self._lock:
+                self._stats[name]["calls"] += 1
+                self._stats[name]["total_seconds"] += time.perf_counter() - start
+
+    def run(self, image: Any, prep: Any, clean: Callable[[str], str],
+            score: Callable[[str], float]) -> Tuple[str, Optional[str]]:
+        """
+        Return (text, winning engine). Exits on the first cleaned result at or above the threshold;
+        otherwise falls back to the best heuristic score among all finished engines.
+        """
+        with self._lock:
+            self.runs += 1
+        done_event = threading.Event()
+        futures = {self._executor.submit(self._timed, name, engine, image, prep, done_event): (name, bonus)
+                   for name, engine, bonus in self._engines}
+        candidates: List[Tuple[float, str, str]] = []
+        pending = set(futures)
+        deadline = time.monotonic() + self.timeout
+        winner: Optional[Tuple[str, str]] = None
+        while pending and winner is None:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                name, bonus = futures[future]
+                text, confidence = future.result()
+                text = clean(text)
+                if not text:
+                    continue
+                if confidence >= self.threshold:
+                    winner = (text, name)
+                    break
+                candidates.append((score(text) + bonus, text, name))
+
+        # Queued engines are dropped; running ones see cancelled() at their next stage boundary
+        done_event.set()
+        running = sum(1 for future in pending if not future.cancel())
+        if running:
+            with self._lock:
+                self.abandoned += running
+
+        if winner is not None:
+            with self._lock:
+                if pending:
+                    self.early_exits += 1
+        elif candidates:
+            candidates.sort(key=lambda c: c[0], reverse=True)
+            winner = (candidates[0][1], candidates[0][2])
+        if winner is None:
+            return "", None
+        with self._lock:
+            self._stats[winner[1]]["wins"] += 1
+        return winner
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            engines = {}
+            for name, s in self._stats.items():
+                engines[name] = {
+                    "calls": int(s["calls"]),
+                    "errors": int(s["errors"]),
+                    "wins": int(s["wins"]),
+                    "win_rate": s["wins"] / self.runs if self.runs else 0.0,
+                    "avg_latency_ms": 1000.0 * s["total_seconds"] / s["calls"] if s["calls"] else 0.0,
+                }
+            return {"runs": self.runs, "early_exits": self.early_exits, "abandoned": self.abandoned,
+                    "skipped": self.skipped, "threshold": self.threshold, "workers": self.workers,
+                    "engines": engines}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,159 @@
+"""
+Local retrieval index for rag_store.json
+Hashed TF-IDF embeddings (no network, no model) in an L2-normalized float32 matrix;
+top-k is one matrix-vector product plus argpartition. The matrix is persisted as a
+memory-mapped .npy next to the store and rebuilt only when the store's content changes.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+RAG_INDEX_DIM = int(os.getenv("MIILA_RAG_DIM", "512"))
+RAG_TOP_K = int(os.getenv("MIILA_RAG_TOP_K", "3"))
+# Bump when tokenization/weighting changes so persisted matrices are rebuilt
+INDEX_VERSION = "1"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word unigrams plus adjacent-word bigrams
+    """
+    words = [w for w in _TOKEN.findall((text or "").lower()) if len(w) > 1 or w.isdigit()]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _bucket(token: str, dim: int) -> Tuple[int, float]:
+    # crc32 is stable across processes (unlike hash()), which the persisted matrix relies on
+    h = zlib.crc32(token.encode("utf-8"))
+    return h % dim, (1.0 if (h >> 31) & 1 == 0 else -1.0)
+
+
+def term_counts(text: str, dim: int) -> Dict[int, float]:
+    """
+    Signed hashed term frequencies with sublinear (1 + log tf) scaling
+    """
+    raw: Dict[str, int] = {}
+    for token in tokenize(text):
+        raw[token] = raw.get(token, 0) + 1
+    counts: Dict[int, float] = {}
+    for token, tf in raw.items():
+        idx, sign = _bucket(token, dim)
+        counts[idx] = counts.get(idx, 0.0) + sign * (1.0 + math.log(tf))
+    return counts
+
+
+class RagIndex:
+    """Immutable retrieval index over (id, title, content) documents"""
+
+    def __init__(self, docs: Sequence[Tuple[Any, str, str]], matrix: np.ndarray, idf: np.ndarray):
+        self.docs = tuple(docs)
+        self.matrix = matrix
+        self.idf = idf
+        self.dim = idf.shape[0]
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @staticmethod
+    def _text(doc: Tuple[Any, str, str]) -> str:
+        return f"{doc[1]} {doc[2]}"
+
+    @classmethod
+    def build(cls, docs: Sequence[Tuple[Any, str, str]], dim: int = RAG_INDEX_DIM) -> "RagIndex":
+        rows = [term_counts(cls._text(d), dim) for d in docs]
+        df = np.zeros(dim, dtype=np.float32)
+        for row in rows:
+            for idx in row:
+                df[idx] += 1.0
+        n = len(rows)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        matrix = np.zeros((n, dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            for idx, value in row.items():
+                matrix[i, idx] = value
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        return cls(docs, matrix, idf)
+
+    @classmethod
+    def load_or_build(cls, store_path: str, docs: Sequence[Tuple[Any, str, str]],
+                      dim: int = RAG_INDEX_DIM) -> "RagIndex":
+        """
+        Reuse <store>.index.npy (memory-mapped) if it was built from these documents, else rebuild and persist
+        """
+        base = os.path.splitext(store_path)[0]
+        matrix_path, meta_path = f"{base}.index.npy", f"{base}.index.json"
+        digest = hashlib.sha256(json.dumps([INDEX_VERSION, dim, [list(d) for d in docs]], ensure_ascii=False,
+                                           default=str).encode("utf-8")).hexdigest()
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("digest") == digest and len(docs) > 0:
+                matrix = np.load(matrix_path, mmap_mode="r")
+                if matrix.shape == (len(docs), dim):
+                    return cls(docs, matrix, np.asarray(meta["idf"], dtype=np.float32))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # Missing, truncated (np.load raises ValueError) or malformed files: rebuild below
+            pass
+
+        index = cls.build(docs, dim)
+        if len(docs) > 0:
+            # Unique per writer: concurrent builds (workers, threads) never interleave in one temp file
+            suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp_matrix, tmp_meta = f"{base}.index.{suffix}.npy", f"{meta_path}.{suffix}"
+            try:
+                np.save(tmp_matrix, index.matrix)
+                with open(tmp_meta, "w", encoding="utf-8") as f:
+                    json.dump({"digest": digest, "dim": dim, "count": len(docs), "idf": index.idf.tolist()}, f)
+                # Matrix first: a meta file never points at a stale matrix
+                os.replace(tmp_matrix, matrix_path)
+                os.replace(tmp_meta, meta_path)
+            except OSError as e:
+                print(f"Could not persist RAG index: {e}")
+                for path in (tmp_matrix, tmp_meta):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                return index
+            try:
+                matrix = np.load(matrix_path, mmap_mode="r")
+                if matrix.shape == index.matrix.shape:
+                    index.matrix = matrix
+            except (OSError, ValueError) as e:
+                # Replaced underneath us by a broken file; keep serving the in-memory matrix
+                print(f"Could not map persisted RAG index: {e}")
+        return index
+
+    def encode(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for idx, value in term_counts(text, self.dim).items():
+            vector[idx] = value
+        vector *= self.idf
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def search(self, query: str, k: int = RAG_TOP_K) -> List[Dict[str, Any]]:
+        """
+        Top-k documents by cosine similarity, best first (documents with score <= 0 are dropped)
+        """
+        if not self.docs or k <= 0:
+            return []
+        scores = self.matrix @ self.encode(query)
+        k = min(k, len(self.docs))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.docs[i][0], "title": self.docs[i][1], "content": self.docs[i][2], "score": round(float(scores[i]), 4)}
+            for i in top if scores[i] > 0
+        ]
@@ -0,0 +1,163 @@
+"""
+Hot-reloadable rag_store.json
+A polling thread re-parses the store when its mtime/size changes and atomically swaps in an
+immutable snapshot (items, variants, retrieval index). Readers just take the current reference.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from rag_index import RagIndex
+
+RAG_POLL_SECONDS = float(os.getenv("MIILA_RAG_POLL_SECONDS", "2.0"))
+
+
+class RagSnapshot:
+    """One parsed version of the store and the indexes derived from it; never mutated"""
+
+    __slots__ = ("items", "poc_variants", "question", "index", "signature", "loaded_at")
+
+    def __init__(self, items: Tuple[Tuple[Any, str, str], ...], poc_variants: Tuple[str, ...], question: str,
+                 index: RagIndex, signature: Optional[Tuple[float, int]]):
+        self.items = items
+        self.poc_variants = poc_variants
+        self.question = question
+        self.index = index
+        self.signature = signature
+        self.loaded_at = time.time()
+
+
+def parse_store(data: Any) -> Tuple[Tuple[Tuple[Any, str, str], ...], Tuple[str, ...], str]:
+    """
+    (items, poc_variants, question) from the decoded JSON; raises ValueError if it has the wrong shape
+    """
+    # Backward compatibility if file previously stored list
+    if isinstance(data, list):
+        data = {"items": data, "poc_variants": []}
+    if not isinstance(data, dict):
+        raise ValueError("rag_store must be an object or a list of items")
+    items = data.get("items") or []
+    variants = data.get("poc_variants") or []
+    if not isinstance(items, list) or not isinstance(variants, list):
+        raise ValueError("'items' and 'poc_variants' must be lists")
+    parsed_items = tuple(
+        (item.get("id"), str(item.get("title", "")), str(item.get("content", "")))
+        for item in items if isinstance(item, dict)
+    )
+    return parsed_items, tuple(str(v) for v in variants), str(data.get("question") or "")
+
+
+class RagStoreManager:
+    """Owns the current RagSnapshot of one store file"""
+
+    def __init__(self, path: str, seed: Optional[Dict[str, Any]] = None, poll_interval: float = RAG_POLL_SECONDS):
+        self.path = path
+        self.seed = seed
+        self.poll_interval = max(0.2, poll_interval)
+        self._snapshot: Optional[RagSnapshot] = None
+        self._reload_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        # (mtime, size) of the last file that failed to load; not retried until it changes
+        self._failed_signature: Optional[Tuple[float, int]] = None
+
+    def snapshot(self) -> RagSnapshot:
+        """
+        Current snapshot. Never waits on a reload once the first one has finished.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def _ensure_seeded(self) -> None:
+        if self.seed is None or os.path.exists(self.path):
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.seed, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def _signature(self) -> Optional[Tuple[float, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def refresh(self) -> bool:
+        """
+        Reload if the file changed. Returns True when a new snapshot was swapped in.
+        A malformed file keeps the previous snapshot and is skipped until it changes again.
+        """
+        with self._reload_lock:
+            try:
+                self._ensure_seeded()
+            except OSError as e:
+                print(f"Could not seed {self.path}: {e}")
+            signature = self._signature()
+            current = self._snapshot
+            if current is not None and signature in (current.signature, self._failed_signature):
+                return False
+            try:
+                if signature is None:
+                    raise ValueError("store file missing")
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if self._signature() != signature:
+                    # Still being written; pick it up on the next poll
+                    return False
+                items, variants, question = parse_store(data)
+                index = RagIndex.load_or_build(self.path, items)
+            except (OSError, ValueError) as e:
+                self.failures += 1
+                self.last_error = str(e)
+                self._failed_signature = signature
+                if current is None:
+                    # Nothing to keep yet: serve an empty store rather than failing requests
+                    self._snapshot = RagSnapshot((), (), "", RagIndex.build(()), None)
+                else:
+                    print(f"rag_store reload failed, keeping previous snapshot: {e}")
+                return False
+            # Single reference assignment: readers see either the old or the new snapshot
+            self._snapshot = RagSnapshot(items, variants, question, index, signature)
+            self.reloads += 1
+            self.last_error = None
+            self._failed_signature = None
+            return True
+
+    def start(self) -> None:
+        self.refresh()
+        if self._thread is not None:
+            return
+
+        def _run():
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"rag_store poll failed: {e}")
+
+        self._thread = threading.Thread(target=_run, name="miila-rag-store", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "items": len(snapshot.items) if snapshot else 0,
+            "poc_variants": len(snapshot.poc_variants) if snapshot else 0,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
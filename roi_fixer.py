@@ -4,7 +4,29 @@ Takes the current colored boxes and moves them to actual answer locations
 """
 import cv2
 import numpy as np
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Any, Optional
+
+# Analysis status -> colour name used by the detected-box path
+STATUS_COLORS = {
+    'perfect': 'green',
+    'correct_no_steps': 'orange',
+    'wrong': 'red',
+    'empty': 'blue'
+}
+
+COLORS_BGR = {
+    'green': (0, 255, 0),
+    'orange': (0, 140, 255),
+    'red': (0, 0, 255),
+    'blue': (255, 0, 0)
+}
+
+COLOR_SYMBOLS = {
+    'green': "✓✓",
+    'orange': "✓?",
+    'red': "✗",
+    'blue': "?"
+}
 
 class ROIBoxFixer:
     """Fixes box positions using ROI detection"""
@@ -16,7 +38,12 @@ class ROIBoxFixer:
         """
         Detect existing colored boxes in the image by looking for rectangular outlines
         """
-        image = cv2.imread(image_path)
+        return self.detect_colored_boxes_in(cv2.imread(image_path))
+    
+    def detect_colored_boxes_in(self, image: np.ndarray) -> List[Dict]:
+        """
+        Same as detect_colored_boxes, on an already decoded BGR image
+        """
         height, width = image.shape[:2]
         
         detected_boxes = []
@@ -80,7 +107,12 @@ class ROIBoxFixer:
         This avoids any detection instability and guarantees boxes sit on the
         handwritten answer lines.
         """
-        image = cv2.imread(image_path)
+        return self.find_answer_locations_in(cv2.imread(image_path))
+    
+    def find_answer_locations_in(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        Same as find_answer_locations, on an already decoded image
+        """
         height, width = image.shape[:2]
 
         # Tunable constants (fractions of width/height)
@@ -111,59 +143,70 @@ class ROIBoxFixer:
         """
         # Load original image
         image = cv2.imread(image_path)
-        height, width = image.shape[:2]
         
+        # Create clean image (load original without boxes)
+        clean_image = cv2.imread(image_path.replace('_checked', ''))  # Remove boxes
+        
+        fixed = self.fix_box_positions_in(image, clean_image)
+        
+        # Save corrected image
+        cv2.imwrite(output_path, fixed)
+        print(f"Fixed image saved to: {output_path}")
+        
+        return output_path
+    
+    def fix_box_positions_in(self, image: np.ndarray, clean_image: np.ndarray = None) -> np.ndarray:
+        """
+        In-memory variant: take the annotated image and the clean original, return the fixed image.
+        The boxes are drawn onto clean_image in place.
+        """
         # Detect existing colored boxes
-        detected_boxes = self.detect_colored_boxes(image_path)
+        detected_boxes = self.detect_colored_boxes_in(image)
         print(f"Detected {len(detected_boxes)} colored boxes")
         
         # Get correct answer locations
-        answer_locations = self.find_answer_locations(image_path)
+        answer_locations = self.find_answer_locations_in(image)
         
-        # Create clean image (load original without boxes)
-        clean_image = cv2.imread(image_path.replace('_checked', ''))  # Remove boxes
         if clean_image is None:
             clean_image = image.copy()
         
-        # Color mapping
-        colors_bgr = {
-            'green': (0, 255, 0),
-            'orange': (0, 140, 255),  
-            'red': (0, 0, 255),
-            'blue': (255, 0, 0)
-        }
-        
-        status_symbols = {
-            'green': "✓✓",
-            'orange': "✓?",
-            'red': "✗", 
-            'blue': "?"
-        }
-        
-        # Sort detected boxes by problem index to maintain order
-        detected_boxes.sort(key=lambda x: x['problem_index'])
+        # Each detected colour goes to the answer location of the region it was found in;
+        # problems whose box was not detected are left undrawn
+        color_names = [None] * len(answer_locations)
+        for box in detected_boxes:
+            if box['problem_index'] < len(color_names):
+                color_names[box['problem_index']] = box['color']
         
         # Draw boxes at correct answer positions
-        for i, box in enumerate(detected_boxes):
-            if i < len(answer_locations):
+        self._draw_boxes(clean_image, answer_locations, color_names)
+        
+        return clean_image
+    
+    def render_status_boxes(self, image: np.ndarray, problems: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Single pass: draw each problem's status colour straight at its answer location.
+        Matches draw_feedback + fix_box_positions_in whenever detection finds every box,
+        without the HSV colour detection. Draws onto image in place.
+        """
+        answer_locations = self.find_answer_locations_in(image)
+        color_names = [STATUS_COLORS.get(p.get('status', 'empty'), 'blue') for p in problems]
+        self._draw_boxes(image, answer_locations, color_names)
+        return image
+    
+    def _draw_boxes(self, image: np.ndarray, answer_locations: List[Tuple[int, int, int, int]], color_names: List[Optional[str]]) -> None:
+        for i, color_name in enumerate(color_names):
+            if color_name is not None and i < len(answer_locations):
                 x, y, w, h = answer_locations[i]
-                color_name = box['color']
-                color = colors_bgr.get(color_name, (128, 128, 128))
-                symbol = status_symbols.get(color_name, "?")
+                color = COLORS_BGR.get(color_name, (128, 128, 128))
+                symbol = COLOR_SYMBOLS.get(color_name, "?")
                 
                 print(f"Problem {i+1}: Drawing {color_name} box at answer location ({x}, {y})")
                 
                 # Draw rectangle at correct answer position
-                cv2.rectangle(clean_image, (x, y), (x + w, y + h), color, 3)
+                cv2.rectangle(image, (x, y), (x + w, y + h), color, 3)
                 
                 # Add status symbol
-                cv2.putText(clean_image, symbol, (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-        
-        # Save corrected image
-        cv2.imwrite(output_path, clean_image)
-        print(f"Fixed image saved to: {output_path}")
-        
-        return output_path
+                cv2.putText(image, symbol, (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
 # Usage function
 def fix_worksheet_boxes(input_image: str) -> str:
@@ -173,3 +216,10 @@ def fix_worksheet_boxes(input_image: str) -> str:
     fixer = ROIBoxFixer()
     output_path = input_image.replace('.', '_fixed.')
     return fixer.fix_box_positions(input_image, output_path)
+
+def fix_worksheet_boxes_image(annotated: np.ndarray, clean: np.ndarray) -> np.ndarray:
+    """
+    In-memory variant of fix_worksheet_boxes (no file I/O)
+    """
+    fixer = ROIBoxFixer()
+    return fixer.fix_box_positions_in(annotated, clean)
@@ -0,0 +1,322 @@
+"""
+Room brokers for the signaling hub
+LocalBroker keeps rooms inside one process (default). RedisBroker fans messages out between
+uvicorn workers / nodes over Redis pub/sub (RESP) on TCP or a Unix socket. Without a Redis
+server, `python signal_broker.py [url]` runs a minimal RESP pub/sub stand-in.
+"""
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+# "local", "redis://host:port" or "unix:///path/to/socket"
+SIGNAL_BROKER = os.getenv("MIILA_SIGNAL_BROKER", "local")
+SIGNAL_CHANNEL_PREFIX = "miila:signal:"
+# Publications waiting for a slow or stalled Redis; beyond this they are dropped (counted in stats)
+SIGNAL_BROKER_QUEUE_SIZE = int(os.getenv("MIILA_SIGNAL_BROKER_QUEUE_SIZE", "1024"))
+STANDIN_DEFAULT_URL = "redis://127.0.0.1:6380"
+
+# deliver(room, message) hands a message from another worker to local peers
+Deliver = Callable[[str, str], None]
+
+
+def encode_command(*args: Any) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    One RESP value: simple string, error (returned as an Exception), integer, bulk string or array
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("broker connection closed")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body
+    if kind == b"-":
+        return RuntimeError(body.decode(errors="replace"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"unexpected RESP type {kind!r}")
+
+
+def _parse_url(url: str) -> Tuple[str, Any]:
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return "unix", parsed.path
+    return "tcp", (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+
+
+class RoomBroker:
+    """Carries messages for a room to the other processes serving it"""
+
+    name = "local"
+
+    async def start(self, deliver: Deliver) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def subscribe(self, room: str) -> None:
+        """A room got its first local peer"""
+
+    def unsubscribe(self, room: str) -> None:
+        """A room lost its last local peer"""
+
+    def publish(self, room: str, message: str) -> None:
+        """Forward a message published by a local peer (never awaited by the relay path)"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"broker": self.name}
+
+
+class LocalBroker(RoomBroker):
+    """Single process: the hub's own fan-out already reaches every peer"""
+
+
+class RedisBroker(RoomBroker):
+    """
+    Redis pub/sub broker. One subscriber connection (one channel per room with local peers)
+    and one publisher connection fed from a bounded queue by a single writer task that awaits
+    drain(), so a slow Redis drops publications instead of growing the transport buffer;
+    reconnects with backoff. Messages are tagged with a worker id so a worker ignores its own
+    publications.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = SIGNAL_CHANNEL_PREFIX, queue_size: int = SIGNAL_BROKER_QUEUE_SIZE):
+        self.url = url
+        self.prefix = prefix
+        self.queue_size = max(1, queue_size)
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._rooms: Set[str] = set()
+        self._deliver: Optional[Deliver] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sub_writer: Optional[asyncio.StreamWriter] = None
+        self._pub_writer: Optional[asyncio.StreamWriter] = None
+        self._pub_queue: Optional[asyncio.Queue] = None
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        kind, address = _parse_url(self.url)
+        if kind == "unix":
+            return await asyncio.open_unix_connection(address)
+        return await asyncio.open_connection(*address)
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pub_queue = None
+        self._close_writers()
+
+    def _close_writers(self) -> None:
+        for writer in (self._sub_writer, self._pub_writer):
+            if writer is not None:
+                writer.close()
+        self._sub_writer = self._pub_writer = None
+        self.connected = False
+
+    @staticmethod
+    async def _discard_replies(reader: asyncio.StreamReader) -> None:
+        while True:
+            await read_reply(reader)
+
+    @staticmethod
+    async def _write_publications(writer: asyncio.StreamWriter, queue: asyncio.Queue) -> None:
+        while True:
+            writer.write(await queue.get())
+            # Pipeline whatever queued up meanwhile, then wait for the socket to take it
+            while not queue.empty():
+                writer.write(queue.get_nowait())
+            await writer.drain()
+
+    async def _run(self) -> None:
+        backoff = 0.5
+        while True:
+            drain = publisher = None
+            try:
+                sub_reader, self._sub_writer = await self._connect()
+                pub_reader, self._pub_writer = await self._connect()
+                if self._rooms:
+                    self._sub_writer.write(encode_command("SUBSCRIBE", *[self.prefix + r for r in self._rooms]))
+                drain = asyncio.create_task(self._discard_replies(pub_reader))
+                self._pub_queue = asyncio.Queue(maxsize=self.queue_size)
+                publisher = asyncio.create_task(self._write_publications(self._pub_writer, self._pub_queue))
+                # A failed publisher connection ends the subscriber read below, so both reconnect
+                sub_writer = self._sub_writer
+                publisher.add_done_callback(lambda t: t.cancelled() or t.exception() is None or sub_writer.close())
+                self.connected = True
+                backoff = 0.5
+                print(f"Signaling broker connected: {self.url}")
+                while True:
+                    reply = await read_reply(sub_reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self._on_message(reply[1].decode(), reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected:
+                    print(f"Signaling broker disconnected: {e}")
+                self.reconnects += 1
+            finally:
+                for task in (drain, publisher):
+                    if task is not None:
+                        task.cancel()
+                self._pub_queue = None
+                self._close_writers()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10.0)
+
+    def _on_message(self, channel: str, data: bytes) -> None:
+        try:
+            envelope = json.loads(data)
+        except ValueError:
+            return
+        if envelope.get("o") == self.worker_id or not channel.startswith(self.prefix):
+            return
+        self.received += 1
+        if self._deliver is not None:
+            self._deliver(channel[len(self.prefix):], envelope.get("m", ""))
+
+    def subscribe(self, room: str) -> None:
+        self._rooms.add(room)
+        if self._sub_writer is not None:
+            self._sub_writer.write(encode_command("SUBSCRIBE", self.prefix + room))
+
+    def unsubscribe(self, room: str) -> None:
+        self._rooms.discard(room)
+        if self._sub_writer is not None:
+            self._sub_writer.write(encode_command("UNSUBSCRIBE", self.prefix + room))
+
+    def publish(self, room: str, message: str) -> None:
+        if self._pub_queue is None:
+            # Broker down: local peers still get the message, other workers miss it
+            self.dropped += 1
+            return
+        envelope = json.dumps({"o": self.worker_id, "m": message})
+        try:
+            self._pub_queue.put_nowait(encode_command("PUBLISH", self.prefix + room, envelope))
+        except asyncio.QueueFull:
+            # Redis is not keeping up; same outcome as a broker outage for this message
+            self.dropped += 1
+            return
+        self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "broker": self.name,
+            "url": self.url,
+            "worker_id": self.worker_id,
+            "connected": self.connected,
+            "rooms": len(self._rooms),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "queued": self._pub_queue.qsize() if self._pub_queue is not None else 0,
+            "reconnects": self.reconnects,
+        }
+
+
+def make_broker(spec: str = SIGNAL_BROKER) -> RoomBroker:
+    spec = (spec or "local").strip()
+    if spec.startswith(("redis://", "unix://")):
+        return RedisBroker(spec)
+    if spec != "local":
+        print(f"Unknown signaling broker {spec!r}, using local")
+    return LocalBroker()
+
+
+async def serve(url: str = STANDIN_DEFAULT_URL) -> None:
+    """
+    Minimal RESP pub/sub server (SUBSCRIBE, UNSUBSCRIBE, PUBLISH, PING) for deployments without Redis
+    """
+    channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+    def _push(writer: asyncio.StreamWriter, *items: Any) -> None:
+        parts = [b"*%d\r\n" % len(items)]
+        for item in items:
+            if isinstance(item, int):
+                parts.append(b":%d\r\n" % item)
+            else:
+                parts.append(b"$%d\r\n%s\r\n" % (len(item), item))
+        writer.write(b"".join(parts))
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        mine: List[bytes] = []
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    continue
+                name = command[0].upper()
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        channels.setdefault(channel, set()).add(writer)
+                        if channel not in mine:
+                            mine.append(channel)
+                        _push(writer, b"subscribe", channel, len(mine))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(mine):
+                        channels.get(channel, set()).discard(writer)
+                        if channel in mine:
+                            mine.remove(channel)
+                        _push(writer, b"unsubscribe", channel, len(mine))
+                elif name == b"PUBLISH" and len(command) == 3:
+                    targets = list(channels.get(command[1], ()))
+                    for target in targets:
+                        _push(target, b"message", command[1], command[2])
+                    writer.write(b":%d\r\n" % len(targets))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"-ERR unsupported command\r\n")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            for channel in mine:
+                channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    kind, address = _parse_url(url)
+    if kind == "unix":
+        server = await asyncio.start_unix_server(handle, path=address)
+    else:
+        server = await asyncio.start_server(handle, *address)
+    print(f"Signaling broker stand-in listening on {url}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(serve(sys.argv[1] if len(sys.argv) > 1 else STANDIN_DEFAULT_URL))
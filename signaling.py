@@ -0,0 +1,219 @@
+"""
+WebRTC signaling hub
+Room registry for /ws/signal on asyncio primitives: every connection has a bounded outbound
+queue drained by its own writer task, so one slow peer never delays relay to the others
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from signal_broker import RoomBroker, LocalBroker
+
+SIGNAL_QUEUE_SIZE = int(os.getenv("MIILA_SIGNAL_QUEUE_SIZE", "64"))
+# "disconnect": close a peer whose queue is full (it reconnects and renegotiates); "drop_oldest": keep it, lose old messages
+SIGNAL_OVERFLOW = os.getenv("MIILA_SIGNAL_OVERFLOW", "disconnect").lower()
+SIGNAL_PING_SECONDS = float(os.getenv("MIILA_SIGNAL_PING_SECONDS", "20"))
+SIGNAL_IDLE_SECONDS = float(os.getenv("MIILA_SIGNAL_IDLE_SECONDS", "90"))
+SIGNAL_SEND_TIMEOUT_SECONDS = float(os.getenv("MIILA_SIGNAL_SEND_TIMEOUT_SECONDS", "10"))
+
+# Clients answer a ping with {"type": "pong"}; only inbound traffic counts as liveness
+PING_MESSAGE = json.dumps({"type": "ping"})
+
+
+def _is_pong(message: str) -> bool:
+    # Cheap pre-check: signaling payloads (SDP, ICE) are much larger than a pong
+    if len(message) > 64 or "pong" not in message:
+        return False
+    try:
+        return json.loads(message).get("type") == "pong"
+    except (ValueError, AttributeError):
+        return False
+
+
+class SignalClient:
+    """One websocket in a room with its outbound queue and writer task"""
+
+    def __init__(self, websocket: Any, room: str, role: Optional[str], queue_size: int):
+        self.websocket = websocket
+        self.room = room
+        self.role = role
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.writer: Optional[asyncio.Task] = None
+        # Last inbound message; successful sends prove nothing (a dead peer's buffer still accepts them)
+        self.last_active = time.monotonic()
+        self.closed = False
+        self.dropped = 0
+
+
+class SignalingHub:
+    """Rooms of SignalClients. All methods run on the event loop, so no locks are needed."""
+
+    def __init__(self, queue_size: int = SIGNAL_QUEUE_SIZE, overflow: str = SIGNAL_OVERFLOW,
+                 ping_interval: float = SIGNAL_PING_SECONDS, idle_timeout: float = SIGNAL_IDLE_SECONDS,
+                 send_timeout: float = SIGNAL_SEND_TIMEOUT_SECONDS, broker: Optional[RoomBroker] = None):
+        self.queue_size = queue_size
+        self.overflow = overflow if overflow in ("disconnect", "drop_oldest") else "disconnect"
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.rooms: Dict[str, Set[SignalClient]] = {}
+        # Carries room traffic to other workers; the local broker is a no-op
+        self.broker = broker or LocalBroker()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.relayed = 0
+        self.dropped = 0
+        self.overflow_disconnects = 0
+        self.reaped = 0
+        self.pongs = 0
+
+    def join(self, websocket: Any, room: str, role: Optional[str] = None) -> SignalClient:
+        client = SignalClient(websocket, room, role, self.queue_size)
+        if room not in self.rooms:
+            self.rooms[room] = set()
+            self.broker.subscribe(room)
+        self.rooms[room].add(client)
+        client.writer = asyncio.create_task(self._write(client))
+        return client
+
+    def _detach(self, client: SignalClient) -> bool:
+        """
+        Remove client from its room and stop its writer; False if it was already detached
+        """
+        if client.closed:
+            return False
+        client.closed = True
+        group = self.rooms.get(client.room)
+        if group is not None:
+            group.discard(client)
+            if not group:
+                self.rooms.pop(client.room, None)
+                self.broker.unsubscribe(client.room)
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        return True
+
+    async def leave(self, client: SignalClient) -> None:
+        if self._detach(client):
+            await self._close(client)
+
+    @staticmethod
+    async def _close(client: SignalClient) -> None:
+        try:
+            await client.websocket.close()
+        except Exception:
+            pass
+
+    def touch(self, client: SignalClient) -> None:
+        client.last_active = time.monotonic()
+
+    def receive(self, client: SignalClient, message: str) -> int:
+        """
+        Inbound message from client: refresh its liveness and relay it, except heartbeat pongs.
+        Returns the number of local peers queued for.
+        """
+        self.touch(client)
+        if _is_pong(message):
+            self.pongs += 1
+            return 0
+        return self.publish(client.room, message, sender=client)
+
+    def publish(self, room: str, message: str, sender: Optional[SignalClient] = None) -> int:
+        """
+        Queue message for every other peer in the room without awaiting any of them, and hand
+        it to the broker for peers on other workers. Returns the number of local peers queued for.
+        """
+        self.broker.publish(room, message)
+        return self._fanout(room, message, sender)
+
+    def _deliver_remote(self, room: str, message: str) -> None:
+        # From another worker: local fan-out only, never re-published
+        self._fanout(room, message, None)
+
+    def _fanout(self, room: str, message: str, sender: Optional[SignalClient]) -> int:
+        delivered = 0
+        for client in list(self.rooms.get(room, ())):
+            if client is sender or client.closed:
+                continue
+            if self._enqueue(client, message):
+                delivered += 1
+        self.relayed += delivered
+        return delivered
+
+    def _enqueue(self, client: SignalClient, message: str) -> bool:
+        try:
+            client.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.overflow == "drop_oldest":
+            try:
+                client.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            client.dropped += 1
+            self.dropped += 1
+            client.queue.put_nowait(message)
+            return True
+        self.overflow_disconnects += 1
+        if self._detach(client):
+            asyncio.create_task(self._close(client))
+        return False
+
+    async def _write(self, client: SignalClient) -> None:
+        try:
+            while not client.closed:
+                message = await client.queue.get()
+                # A send that cannot complete in time means the peer is gone or hopelessly slow
+                await asyncio.wait_for(client.websocket.send_text(message), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            await self.leave(client)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            for group in list(self.rooms.values()):
+                for client in list(group):
+                    if self.idle_timeout and now - client.last_active > self.idle_timeout:
+                        # No pong or other message for idle_timeout: half-open or unresponsive peer
+                        self.reaped += 1
+                        await self.leave(client)
+                    elif now - client.last_active >= self.ping_interval:
+                        try:
+                            client.queue.put_nowait(PING_MESSAGE)
+                        except asyncio.QueueFull:
+                            # Backlogged peer; overflow handling or the idle timeout deals with it
+                            pass
+
+    async def start(self) -> None:
+        await self.broker.start(self._deliver_remote)
+        if self._heartbeat is None and self.ping_interval > 0:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for group in list(self.rooms.values()):
+            for client in list(group):
+                await self.leave(client)
+        await self.broker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rooms": len(self.rooms),
+            "clients": sum(len(g) for g in self.rooms.values()),
+            "max_room_size": max((len(g) for g in self.rooms.values()), default=0),
+            "queued": sum(c.queue.qsize() for g in self.rooms.values() for c in g),
+            "relayed": self.relayed,
+            "dropped": self.dropped,
+            "overflow_disconnects": self.overflow_disconnects,
+            "reaped": self.reaped,
+            "pongs": self.pongs,
+            "overflow_policy": self.overflow,
+            **self.broker.stats(),
+        }
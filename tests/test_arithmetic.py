@@ -0,0 +1,25 @@
+"""
+ArithmeticEngine.grade_problem: solvable problems are graded locally, the rest are never guessed wrong
+"""
+import pytest
+
+pytest.importorskip("cv2")
+
+from math_checker import ArithmeticEngine
+
+
+def test_unparsable_but_correct_answer_is_not_marked_wrong():
+    problem = ArithmeticEngine().grade_problem({"problem": "3 + 4 + 5 =", "handwritten": "12", "steps_shown": []})
+    assert problem["status"] == "empty"
+    assert "review" in problem["feedback"]
+
+
+def test_unparsable_keeps_model_status():
+    problem = ArithmeticEngine().grade_problem({"problem": "3 + 4 + 5 =", "handwritten": "12", "status": "perfect"})
+    assert problem["status"] == "perfect"
+
+
+def test_simple_problem_is_graded_locally():
+    engine = ArithmeticEngine()
+    assert engine.grade_problem({"problem": "426 + 267 =", "handwritten": "693"})["status"] == "correct_no_steps"
+    assert engine.grade_problem({"problem": "426 + 267 =", "handwritten": "692"})["status"] == "wrong"
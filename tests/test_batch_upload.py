@@ -0,0 +1,88 @@
+"""
+Limits of POST /batch/analyze-worksheets: zip entries are checked from the zip directory before
+decompression, single files against the per-item limit, and new jobs against the in-flight limit
+"""
+import io
+import zipfile
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+pytest.importorskip("multipart")
+from fastapi.testclient import TestClient
+
+import backend_api
+
+API_KEY = "sk-" + "a" * 40
+
+
+def _zip(entries):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    reads = []
+    original_read = zipfile.ZipFile.read
+
+    def counting_read(self, name, pwd=None):
+        reads.append(getattr(name, "filename", name))
+        return original_read(self, name, pwd)
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", counting_read)
+    # Nothing may be queued for grading when a batch is rejected
+    monkeypatch.setattr(backend_api._batch_executor, "submit", lambda *a, **k: pytest.fail("batch item submitted"))
+    client = TestClient(backend_api.app)
+    client.reads = reads
+    return client
+
+
+def _post(client, archive):
+    return client.post("/batch/analyze-worksheets", data={"api_key": API_KEY},
+                       files={"files": ("class.zip", archive, "application/zip")})
+
+
+def test_rejects_oversized_entry_without_decompressing(client, monkeypatch):
+    monkeypatch.setattr(backend_api, "UPLOAD_MAX_BYTES", 64 * 1024)
+    # 1 MB of zeros deflates to about a kilobyte
+    response = _post(client, _zip([("bomb.png", b"\0" * (1024 * 1024))]))
+    assert response.status_code == 413
+    assert client.reads == []
+
+
+def test_rejects_unpacked_total_over_batch_limit(client, monkeypatch):
+    monkeypatch.setattr(backend_api, "BATCH_UPLOAD_MAX_BYTES", 256 * 1024)
+    entries = [(f"ws{i}.png", b"\0" * (100 * 1024)) for i in range(4)]
+    response = _post(client, _zip(entries))
+    assert response.status_code == 413
+    # The first two fit the budget; the third is refused from its declared size
+    assert len(client.reads) == 2
+
+
+def test_rejects_too_many_entries(client, monkeypatch):
+    monkeypatch.setattr(backend_api, "BATCH_MAX_ITEMS", 3)
+    response = _post(client, _zip([(f"ws{i}.png", b"\x89PNG") for i in range(10)]))
+    assert response.status_code == 413
+    assert len(client.reads) == 3
+
+
+def test_rejects_oversized_single_image(client, monkeypatch):
+    monkeypatch.setattr(backend_api, "UPLOAD_MAX_BYTES", 64 * 1024)
+    response = client.post("/batch/analyze-worksheets", data={"api_key": API_KEY},
+                           files={"files": ("big.png", b"\x89PNG" + b"\0" * (128 * 1024), "image/png")})
+    assert response.status_code == 413
+
+
+def test_rejects_new_job_while_too_many_are_in_flight(client, monkeypatch):
+    monkeypatch.setattr(backend_api, "BATCH_MAX_ACTIVE_JOBS", 2)
+    running = {f"job{i}": {"job_id": f"job{i}", "created_at": 0.0, "finished_at": None, "items": []} for i in range(2)}
+    monkeypatch.setattr(backend_api, "_batch_jobs", running)
+    response = _post(client, _zip([("ws.png", b"\x89PNG")]))
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "30"
+    assert client.reads == []
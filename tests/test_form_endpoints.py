@@ -0,0 +1,34 @@
+"""
+backend_api form endpoints parse with the pinned FastAPI/Starlette (backend_requirements.txt)
+"""
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+pytest.importorskip("multipart")
+from fastapi.testclient import TestClient
+
+import backend_api
+
+
+@pytest.fixture
+def client():
+    return TestClient(backend_api.app)
+
+
+def test_login_form(client):
+    response = client.post("/auth/login", data={"email": backend_api.VALID_EMAIL, "password": backend_api.VALID_PASSWORD})
+    assert response.status_code == 200 and response.json()["success"] is True
+
+
+def test_validate_api_key_form(client):
+    response = client.post("/validate-api-key", data={"api_key": "not-a-key"})
+    assert response.status_code == 200 and response.json()["valid"] is False
+
+
+def test_batch_multipart_form_is_parsed(client, monkeypatch):
+    # A wrong-signature file gets read_upload's 415, so the form itself parsed
+    monkeypatch.setattr(backend_api._batch_executor, "submit", lambda *a, **k: pytest.fail("batch item submitted"))
+    response = client.post("/batch/analyze-worksheets", data={"api_key": "sk-" + "a" * 40},
+                           files={"files": ("ws.png", b"not an image", "image/png")})
+    assert response.status_code == 415
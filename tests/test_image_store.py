@@ -0,0 +1,40 @@
+"""
+Annotated images outlive the process and are visible to every worker through the disk tier
+"""
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from image_store import AnnotatedImageStore
+
+
+def _png():
+    ok, buf = cv2.imencode(".png", np.full((40, 60, 3), 200, dtype=np.uint8))
+    return buf.tobytes()
+
+
+def test_other_worker_serves_image_from_disk(tmp_path):
+    data = _png()
+    image_id = AnnotatedImageStore(cache_dir=str(tmp_path)).put(data)
+
+    # A second store is what another uvicorn worker (or this one after a restart) sees
+    other = AnnotatedImageStore(cache_dir=str(tmp_path))
+    image = other.get(image_id)
+    assert image is not None and image.data == data and image.media_type == "image/png"
+    assert other.get(image_id, "jpeg", 80, 32).media_type == "image/jpeg"
+    assert other.stats()["disk_hits"] == 1
+
+
+def test_memory_eviction_falls_back_to_disk(tmp_path):
+    store = AnnotatedImageStore(max_mb=1, cache_dir=str(tmp_path))
+    first = store.put(_png())
+    store.put(np.random.default_rng(0).bytes(2 * 1024 * 1024))
+    assert store.get(first) is not None
+
+
+def test_rejects_ids_that_are_not_content_hashes(tmp_path):
+    store = AnnotatedImageStore(cache_dir=str(tmp_path))
+    (tmp_path / ("0" * 32 + ".img")).write_bytes(b"not matching its name")
+    assert store.get("../../etc/passwd") is None
+    assert store.get("0" * 32) is None
@@ -0,0 +1,58 @@
+"""
+Cold-start import budget for backend_api: heavy OCR libraries (torch, transformers, easyocr) may
+only load when an OCR path or warm-up needs them, and the import itself stays under budget
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+
+IMPORT_BUDGET_MS = float(os.getenv("MIILA_IMPORT_BUDGET_MS", "1500"))
+FORBIDDEN_MODULES = ("torch", "transformers", "easyocr")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter. The finder sits first on sys.meta_path, so every attempt to import a
+# forbidden module is recorded (and refused) whether or not the library is installed here.
+_PROBE = textwrap.dedent("""
+    import json, sys, time
+
+    FORBIDDEN = {forbidden!r}
+    attempts = []
+
+    class TrapFinder:
+        def find_spec(self, name, path=None, target=None):
+            if name.split(".")[0] in FORBIDDEN:
+                attempts.append(name)
+                raise ImportError(f"{{name}} imported eagerly")
+            return None
+
+    sys.meta_path.insert(0, TrapFinder())
+    start = time.perf_counter()
+    import backend_api
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    loaded = sorted(m for m in sys.modules if m.split(".")[0] in FORBIDDEN)
+    print(json.dumps({{"attempts": attempts, "loaded": loaded, "ms": elapsed_ms}}))
+""")
+
+
+@pytest.fixture(scope="module")
+def probe():
+    proc = subprocess.run([sys.executable, "-c", _PROBE.format(forbidden=FORBIDDEN_MODULES)],
+                          cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_no_heavy_ocr_modules_at_import(probe):
+    assert probe["attempts"] == []
+    assert probe["loaded"] == []
+
+
+def test_import_time_within_budget(probe):
+    assert probe["ms"] <= IMPORT_BUDGET_MS, f"import backend_api took {probe['ms']:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
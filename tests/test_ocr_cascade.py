@@ -0,0 +1,56 @@
+"""
+Early exit of OCRCascade: losing engines are told to stop at their next stage boundary
+"""
+import threading
+
+from ocr_cascade import OCRCascade
+
+
+def test_losing_engine_sees_cancel_after_early_exit():
+    gate = threading.Event()
+    seen = []
+
+    def slow(image, prep, cancelled):
+        gate.wait(5)
+        seen.append(cancelled())
+        return "" if cancelled() else "late", 0.1
+
+    cascade = OCRCascade(threshold=0.8, workers=2)
+    cascade.register("slow", slow)
+    cascade.register("fast", lambda image, prep, cancelled: ("hello", 0.95))
+    try:
+        assert cascade.run(None, None, lambda t: t, len) == ("hello", "fast")
+        gate.set()
+        cascade._executor.shutdown(wait=True)
+        assert seen == [True]
+        stats = cascade.stats()
+        assert stats["early_exits"] == 1 and stats["abandoned"] == 1
+    finally:
+        gate.set()
+        cascade.shutdown()
+
+
+def test_queued_engine_is_skipped_once_cascade_is_done():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocker(image, prep, cancelled):
+        started.set()
+        release.wait(5)
+        return "", 0.0
+
+    cascade = OCRCascade(threshold=0.8, workers=1)
+    # Occupy the only worker so the cascade's engines stay queued until it times out
+    cascade._executor.submit(blocker, None, None, lambda: False)
+    started.wait(5)
+    cascade.timeout = 0.05
+    cascade.register("queued", lambda image, prep, cancelled: calls.append(1) or ("x", 1.0))
+    try:
+        assert cascade.run(None, None, lambda t: t, len) == ("", None)
+        release.set()
+        cascade._executor.shutdown(wait=True)
+        assert calls == []
+    finally:
+        release.set()
+        cascade.shutdown()
@@ -0,0 +1,46 @@
+"""
+Offline grading cache: results without GPT-4o escalation are not served to callers that can escalate
+"""
+from types import SimpleNamespace
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from math_checker import SimpleMathChecker
+
+
+class _DictCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def put(self, key, value):
+        self.data[key] = value
+
+
+def _grade(checker, image_bytes, calls):
+    def offline(image, reader, confidence_threshold):
+        calls.append(checker.client is not None)
+        return {"problems": [{"problem": "2 + 3 =", "handwritten": "5", "steps_shown": []}]}
+
+    checker.analyze_worksheet_offline = offline
+    return checker.check_worksheet_offline(image_bytes, reader=None)
+
+
+def test_unescalated_result_is_not_reused_with_a_client():
+    ok, encoded = cv2.imencode(".png", np.full((600, 400, 3), 255, dtype=np.uint8))
+    image_bytes, cache, calls = encoded.tobytes(), _DictCache(), []
+
+    _grade(SimpleMathChecker(openai_api_key=None, cache=cache), image_bytes, calls)
+    _grade(SimpleMathChecker(openai_api_key=None, cache=cache), image_bytes, calls)
+    assert calls == [False]
+
+    with_client = SimpleMathChecker(openai_api_key=None, cache=cache)
+    with_client.client = SimpleNamespace()
+    _grade(with_client, image_bytes, calls)
+    assert calls == [False, True]
+    assert len(cache.data) == 2
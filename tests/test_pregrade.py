@@ -0,0 +1,74 @@
+"""
+Pre-grading: operator key only, bounded by the grading slots, shared future survives a disconnect
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+
+import backend_api
+from worksheet_index import FixedWorksheet
+
+WORKSHEET = FixedWorksheet("/fixed/ws.png", b"\x89PNG", 1000.0, 4)
+
+
+@pytest.fixture
+def pregrade(monkeypatch):
+    submitted = []
+
+    def submit(fn, *args):
+        future = Future()
+        submitted.append(future)
+        return future
+
+    monkeypatch.setattr(backend_api._fixed_index, "current", lambda: WORKSHEET)
+    monkeypatch.setattr(backend_api._grading_executor, "submit", submit)
+    monkeypatch.setattr(backend_api, "_pregrade_results", {})
+    monkeypatch.setattr(backend_api, "_grading_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(backend_api, "GRADING_MODE", "vision")
+    monkeypatch.setattr(backend_api, "PREGRADE_ENABLED", True)
+    return submitted
+
+
+def test_no_operator_key_no_vision_pregrade(pregrade, monkeypatch):
+    monkeypatch.setattr(backend_api, "PREGRADE_API_KEY", None)
+    backend_api._pregrade(WORKSHEET.path, WORKSHEET.mtime)
+    assert pregrade == []
+
+
+def test_pregrade_holds_a_grading_slot(pregrade, monkeypatch):
+    monkeypatch.setattr(backend_api, "PREGRADE_API_KEY", "sk-" + "b" * 40)
+    backend_api._pregrade(WORKSHEET.path, WORKSHEET.mtime)
+    assert len(pregrade) == 1
+    assert not backend_api._grading_slots.acquire(blocking=False)
+    pregrade[0].set_result({"success": True})
+    assert backend_api._grading_slots.acquire(blocking=False)
+
+
+def test_pregrade_skipped_when_no_slot_is_free(pregrade, monkeypatch):
+    monkeypatch.setattr(backend_api, "PREGRADE_API_KEY", "sk-" + "b" * 40)
+    backend_api._grading_slots.acquire()
+    backend_api._pregrade(WORKSHEET.path, WORKSHEET.mtime)
+    assert pregrade == []
+
+
+def test_cancelled_waiter_does_not_cancel_shared_pregrade(pregrade, monkeypatch):
+    monkeypatch.setattr(backend_api, "PREGRADE_API_KEY", "sk-" + "b" * 40)
+    backend_api._pregrade(WORKSHEET.path, WORKSHEET.mtime)
+    shared = pregrade[0]
+
+    async def scenario():
+        first = asyncio.ensure_future(backend_api._pregraded_response(WORKSHEET, "vision"))
+        second = asyncio.ensure_future(backend_api._pregraded_response(WORKSHEET, "vision"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not shared.cancelled()
+        shared.set_result({"success": True})
+        return await second
+
+    assert asyncio.run(scenario()) == {"success": True}
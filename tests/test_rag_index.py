@@ -0,0 +1,32 @@
+"""
+Persisted RAG index: damaged files are rebuilt, writers use their own temp files
+"""
+import os
+
+import numpy as np
+
+from rag_index import RagIndex
+
+DOCS = [(1, "Fractions", "add fractions with a common denominator"),
+        (2, "Decimals", "line up the decimal point before adding")]
+
+
+def test_truncated_matrix_is_rebuilt(tmp_path):
+    store = str(tmp_path / "rag_store.json")
+    RagIndex.load_or_build(store, DOCS)
+    matrix_path = str(tmp_path / "rag_store.index.npy")
+    with open(matrix_path, "r+b") as f:
+        f.truncate(os.path.getsize(matrix_path) // 2)
+
+    index = RagIndex.load_or_build(store, DOCS)
+    assert index.search("fractions denominator")[0]["id"] == 1
+    assert np.load(matrix_path).shape == (len(DOCS), index.dim)
+
+
+def test_no_temp_files_left_and_names_are_unique(tmp_path, monkeypatch):
+    saved = []
+    real_save = np.save
+    monkeypatch.setattr(np, "save", lambda path, arr: (saved.append(path), real_save(path, arr)))
+    RagIndex.load_or_build(str(tmp_path / "rag_store.json"), DOCS)
+    assert saved and str(os.getpid()) in os.path.basename(saved[0])
+    assert sorted(os.listdir(tmp_path)) == ["rag_store.index.json", "rag_store.index.npy"]
@@ -0,0 +1,39 @@
+"""
+RagStoreManager: a malformed store is parsed once per version, not on every poll
+"""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import rag_store
+from rag_store import RagStoreManager
+
+
+def _write(path, text, mtime):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_malformed_store_is_not_reparsed_until_it_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "rag_store.json")
+    _write(path, json.dumps({"items": [{"id": 1, "title": "Fractions", "content": "common denominator"}]}), 1000)
+    manager = RagStoreManager(path)
+    assert manager.refresh()
+
+    loads = []
+    real_load = json.load
+    monkeypatch.setattr(rag_store.json, "load", lambda f: (loads.append(1), real_load(f))[1])
+    _write(path, "{broken", 2000)
+    for _ in range(3):
+        assert not manager.refresh()
+    assert len(loads) == 1
+    assert manager.stats()["failures"] == 1
+    assert len(manager.snapshot().items) == 1
+
+    _write(path, json.dumps({"items": []}), 3000)
+    assert manager.refresh()
+    assert manager.stats()["last_error"] is None
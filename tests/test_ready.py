@@ -0,0 +1,59 @@
+"""
+/ready: warm-up is opt-in, failed optional models degrade instead of blocking, state follows the ModelManager
+"""
+import os
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient
+
+import backend_api
+from model_manager import ModelManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = ModelManager()
+    manager.register("trocr", lambda: object())
+    manager.register("easyocr", lambda: None)
+    monkeypatch.setattr(backend_api, "_model_manager", manager)
+    monkeypatch.setattr(backend_api, "_warmup_state", {})
+    return manager
+
+
+def _ready():
+    return TestClient(backend_api.app).get("/ready")
+
+
+def test_warmup_is_opt_in():
+    if "MIILA_WARMUP_MODELS" in os.environ:
+        pytest.skip("warm-up configured in this environment")
+    assert backend_api.WARMUP_MODELS == []
+
+
+def test_ready_without_warmup(manager):
+    response = _ready()
+    assert response.status_code == 200
+    assert response.json()["models"]["trocr"]["state"] == "not_loaded"
+
+
+def test_loading_then_failed_model_is_degraded_not_unready(manager, monkeypatch):
+    monkeypatch.setattr(backend_api, "_warmup_state", {"easyocr": {"warmup": "loading", "error": None}})
+    assert _ready().status_code == 503
+
+    manager.get("easyocr")
+    backend_api._warmup_state["easyocr"].update(warmup="failed", error="EasyOCR could not be loaded")
+    response = _ready()
+    body = response.json()
+    assert response.status_code == 200
+    assert body["degraded"] is True
+    assert body["models"]["easyocr"]["state"] == "failed"
+
+
+def test_evicted_model_is_reported_unloaded(manager):
+    manager.get("trocr")
+    assert _ready().json()["models"]["trocr"]["state"] == "ready"
+    manager.evict("trocr")
+    assert _ready().json()["models"]["trocr"]["state"] == "unloaded"
@@ -0,0 +1,58 @@
+"""
+RedisBroker publications go through a bounded queue drained by one writer task
+"""
+import asyncio
+
+from signal_broker import RedisBroker, serve
+
+
+def _run(coro):
+    # asyncio.run cancels and awaits whatever the scenario left running (stand-in connections)
+    return asyncio.run(coro)
+
+
+def test_publish_drops_when_queue_is_full():
+    async def scenario():
+        broker = RedisBroker("redis://127.0.0.1:1", queue_size=2)
+        broker._pub_queue = asyncio.Queue(maxsize=broker.queue_size)
+        for i in range(5):
+            broker.publish("room", f"m{i}")
+        stats = broker.stats()
+        assert stats["published"] == 2 and stats["dropped"] == 3 and stats["queued"] == 2
+
+    _run(scenario())
+
+
+def test_messages_reach_other_worker_through_standin(tmp_path):
+    url = f"unix://{tmp_path}/broker.sock"
+
+    async def scenario():
+        server = asyncio.create_task(serve(url))
+        await asyncio.sleep(0.1)
+        received = []
+        a, b = RedisBroker(url), RedisBroker(url)
+        a.subscribe("room")
+        b.subscribe("room")
+        await a.start(lambda room, message: None)
+        await b.start(lambda room, message: received.append((room, message)))
+        try:
+            for _ in range(50):
+                if a.connected and b.connected:
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.05)
+            for i in range(3):
+                a.publish("room", f"m{i}")
+            for _ in range(50):
+                if len(received) == 3:
+                    break
+                await asyncio.sleep(0.02)
+            assert received == [("room", "m0"), ("room", "m1"), ("room", "m2")]
+            assert a.stats()["queued"] == 0
+        finally:
+            await a.stop()
+            await b.stop()
+            server.cancel()
+            await asyncio.sleep(0.05)
+
+    _run(scenario())
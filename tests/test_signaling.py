@@ -0,0 +1,62 @@
+"""
+Signaling heartbeat: only inbound messages prove liveness, so a peer that still accepts
+writes but never answers is reaped
+"""
+import asyncio
+import json
+
+from signaling import SignalingHub
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_silent_peer_is_reaped_even_though_sends_succeed():
+    async def scenario():
+        hub = SignalingHub(ping_interval=0.02, idle_timeout=0.1)
+        await hub.start()
+        try:
+            silent, answering = FakeWebSocket(), FakeWebSocket()
+            hub.join(silent, "room")
+            peer = hub.join(answering, "room")
+            for _ in range(15):
+                await asyncio.sleep(0.02)
+                hub.receive(peer, json.dumps({"type": "pong"}))
+            assert silent.closed
+            assert not answering.closed
+            # Every ping reached the silent peer; that alone did not keep it alive
+            assert json.dumps({"type": "ping"}) in silent.sent
+            stats = hub.stats()
+            assert stats["reaped"] == 1 and stats["clients"] == 1 and stats["pongs"] == 15
+        finally:
+            await hub.stop()
+
+    _run(scenario())
+
+
+def test_pong_is_not_relayed_but_other_messages_are():
+    async def scenario():
+        hub = SignalingHub(ping_interval=0)
+        a, b = FakeWebSocket(), FakeWebSocket()
+        sender = hub.join(a, "room")
+        hub.join(b, "room")
+        assert hub.receive(sender, '{"type":"pong"}') == 0
+        assert hub.receive(sender, '{"type":"offer","sdp":"pong"}') == 1
+        await asyncio.sleep(0.01)
+        assert b.sent == ['{"type":"offer","sdp":"pong"}']
+        await hub.stop()
+
+    _run(scenario())
@@ -0,0 +1,87 @@
+"""
+analyze_worksheet_stream when the model reply cannot be parsed incrementally or breaks off
+"""
+from types import SimpleNamespace
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from math_checker import SimpleMathChecker
+
+PROBLEM = '{"problem": "2 + 3 =", "handwritten": "5", "steps_shown": []}'
+
+
+class _FakeCompletions:
+    def __init__(self, chunks, finish_reason=None, fail_after=None):
+        self.chunks = chunks
+        self.finish_reason = finish_reason
+        self.fail_after = fail_after
+
+    def create(self, **kwargs):
+        for i, c in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise ConnectionError("stream dropped")
+            last = i == len(self.chunks) - 1
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(
+                delta=SimpleNamespace(content=c), finish_reason=self.finish_reason if last else None)])
+
+
+class _RecordingCache:
+    def __init__(self):
+        self.puts = []
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        self.puts.append(key)
+
+
+def _checker(chunks, **kwargs):
+    checker = SimpleMathChecker(openai_api_key=None, cache=_RecordingCache())
+    checker.client = SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions(chunks, **kwargs)))
+    return checker
+
+
+def _image():
+    image = np.full((600, 400, 3), 255, dtype=np.uint8)
+    ok, encoded = cv2.imencode(".png", image)
+    return encoded.tobytes(), image
+
+
+def test_malformed_reply_yields_no_problems():
+    image_bytes, image = _image()
+    checker = _checker(["Sure! ", "{not json at all", "}"])
+    assert list(checker.analyze_worksheet_stream(image_bytes, image)) == []
+
+
+def test_wrong_shape_reply_yields_no_problems():
+    image_bytes, image = _image()
+    checker = _checker(['{"problems": ', '"none found"}'])
+    assert list(checker.analyze_worksheet_stream(image_bytes, image)) == []
+
+
+def test_dropped_stream_reports_error_and_is_not_cached():
+    image_bytes, _ = _image()
+    checker = _checker(['{"problems": [', PROBLEM, ', ', PROBLEM, ']}'], finish_reason="stop", fail_after=2)
+    events = list(checker.check_worksheet_stream(image_bytes))
+    assert [kind for kind, _ in events] == ["problem", "error"]
+    assert checker.cache.puts == []
+
+
+def test_truncated_reply_is_not_cached():
+    image_bytes, _ = _image()
+    checker = _checker(['{"problems": [', PROBLEM, ', {"problem": "4 +'], finish_reason="length")
+    events = list(checker.check_worksheet_stream(image_bytes))
+    assert [kind for kind, _ in events] == ["problem", "error"]
+    assert checker.cache.puts == []
+
+
+def test_complete_stream_is_cached():
+    image_bytes, _ = _image()
+    checker = _checker(['{"problems": [', PROBLEM, ']}'], finish_reason="stop")
+    events = list(checker.check_worksheet_stream(image_bytes))
+    assert [kind for kind, _ in events] == ["problem", "result"]
+    assert len(checker.cache.puts) == 1
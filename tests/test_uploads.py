@@ -0,0 +1,73 @@
+"""
+Upload layer: forms parse with the stock Starlette parser, read_upload hands back bytes + SHA-256,
+and multipart bodies are cut off at the limit whether or not they declare a Content-Length.
+Only needs fastapi + python-multipart, so it also runs against the pinned backend_requirements.txt.
+"""
+import hashlib
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("multipart")
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.testclient import TestClient
+
+from uploads import UploadLimitMiddleware, read_upload
+
+LIMIT = 4 * 1024 * 1024
+PNG = b"\x89PNG" + b"0" * (2 * 1024 * 1024)
+
+
+def _client():
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_bytes=LIMIT)
+
+    @app.post("/login")
+    async def login(email: str = Form(...), password: str = Form(...)):
+        return {"email": email}
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...), api_key: str = Form(...)):
+        data = await read_upload(file)
+        return {"size": data.size, "sha256": data.sha256, "api_key": api_key}
+
+    return TestClient(app)
+
+
+def _multipart(payload: bytes):
+    boundary = "miilaboundary"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"api_key\"\r\n\r\nsk-test\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n"
+            f"Content-Type: image/png\r\n\r\n").encode()
+    return head + payload + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def test_urlencoded_form_passes_through():
+    response = _client().post("/login", data={"email": "a@b.c", "password": "x"})
+    assert response.status_code == 200 and response.json() == {"email": "a@b.c"}
+
+
+def test_file_upload_is_read_and_hashed():
+    response = _client().post("/upload", data={"api_key": "sk-test"}, files={"file": ("a.png", PNG, "image/png")})
+    assert response.status_code == 200
+    assert response.json() == {"size": len(PNG), "sha256": hashlib.sha256(PNG).hexdigest(), "api_key": "sk-test"}
+
+
+def test_chunked_body_within_limit_is_accepted():
+    body, content_type = _multipart(PNG)
+    chunks = (body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024))
+    response = _client().post("/upload", content=chunks, headers={"content-type": content_type})
+    assert response.status_code == 200 and response.json()["size"] == len(PNG)
+
+
+def test_chunked_body_over_limit_gets_413():
+    body, content_type = _multipart(b"\x89PNG" + b"0" * (LIMIT + 1024))
+    chunks = (body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024))
+    response = _client().post("/upload", content=chunks, headers={"content-type": content_type})
+    assert response.status_code == 413
+
+
+def test_declared_length_over_limit_gets_413():
+    body, content_type = _multipart(b"\x89PNG" + b"0" * (LIMIT + 1024))
+    response = _client().post("/upload", content=body, headers={"content-type": content_type})
+    assert response.status_code == 413
@@ -0,0 +1,65 @@
+"""
+FixedWorksheetIndex reads only the selected worksheet, once per version, and only on refresh
+(the poller thread), so current() never touches the disk
+"""
+import os
+
+import pytest
+
+from worksheet_index import FixedWorksheetIndex
+
+
+def _write(directory, name, data, mtime):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _no_read(*args):
+    pytest.fail("current() read the file")
+
+
+def test_listeners_see_the_loaded_selection(tmp_path):
+    old = _write(tmp_path, "old.png", b"old", 1000)
+    new = _write(tmp_path, "new.png", b"new-worksheet", 2000)
+    seen = []
+    index = FixedWorksheetIndex(str(tmp_path))
+    index.add_listener(lambda path, mtime: seen.append((path, mtime, index.current().path)))
+    index.refresh()
+
+    assert sorted(seen) == [(new, 2000, new), (old, 1000, new)]
+    # Only the selected worksheet is read
+    assert index.reads == 1
+    assert index.stats()["current"] == "new.png" and index.stats()["loaded"]
+
+
+def test_selected_worksheet_read_once_per_version_off_the_request_path(tmp_path, monkeypatch):
+    path = _write(tmp_path, "ws.png", b"v1", 1000)
+    index = FixedWorksheetIndex(str(tmp_path))
+    index.refresh()
+    index.refresh()
+    assert index.reads == 1
+
+    _write(tmp_path, "ws.png", b"v2!", 3000)
+    # Requests keep the loaded snapshot until the next poll swaps in the new version
+    monkeypatch.setattr(FixedWorksheetIndex, "_read", staticmethod(_no_read))
+    assert index.current().data == b"v1"
+    monkeypatch.undo()
+    index.refresh()
+    assert index.current().data == b"v2!"
+    assert index.reads == 2
+
+    os.remove(path)
+    index.refresh()
+    assert index.current() is None
+
+
+def test_pin_first_keeps_selection(tmp_path):
+    _write(tmp_path, "first.png", b"first", 1000)
+    index = FixedWorksheetIndex(str(tmp_path), pin_first=True)
+    index.refresh()
+    _write(tmp_path, "later.png", b"later", 5000)
+    index.refresh()
+    assert index.current().data == b"first"
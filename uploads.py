@@ -0,0 +1,194 @@
+"""
+Shared upload ingestion
+Reads an UploadFile in bounded chunks into memory, rejects wrong types and oversize bodies
+as early as possible and hashes while reading, so handlers get bytes + SHA-256 and never
+write temp files of their own. (Starlette's multipart parser itself still spools files over
+1 MB to a temporary file; UploadLimitMiddleware bounds how much it can spool.)
+"""
+import hashlib
+import os
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+UPLOAD_MAX_BYTES = int(float(os.getenv("MIILA_UPLOAD_MAX_MB", "20")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# Multipart framing and other form fields on top of the file itself
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+IMAGE_TYPES = ("image/",)
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed", "application/octet-stream", "multipart/x-zip")
+
+
+def sniff_upload_type(head: bytes) -> Optional[str]:
+    """
+    Content type from the file signature, None if it is not an image or zip we accept
+    """
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "image/tiff"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    return None
+
+
+def _signature_allowed(sniffed: Optional[str], allowed: Tuple[str, ...]) -> bool:
+    if sniffed is None:
+        return False
+    if sniffed.startswith("image/"):
+        return any(a.startswith("image/") for a in allowed)
+    return any(a in ZIP_TYPES for a in allowed)
+
+
+class UploadedFile:
+    """An upload held in memory with its SHA-256 (a ready-made content key for caches)"""
+
+    __slots__ = ("filename", "content_type", "data", "sha256")
+
+    def __init__(self, filename: str, content_type: str, data: bytearray, sha256: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+        self.sha256 = sha256
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1].lower()
+
+    def view(self) -> memoryview:
+        """
+        Zero-copy view for decoders (np.frombuffer, zipfile via io.BytesIO, ...)
+        """
+        return memoryview(self.data)
+
+
+def check_upload_type(file: UploadFile, allowed: Tuple[str, ...] = IMAGE_TYPES) -> None:
+    """
+    400 unless the declared content type starts with one of the allowed prefixes
+    """
+    content_type = (file.content_type or "").lower()
+    if not content_type.startswith(allowed):
+        raise HTTPException(status_code=400, detail="File must be an image" if allowed == IMAGE_TYPES
+                            else f"Unsupported file type: {content_type or 'unknown'}")
+
+
+async def read_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES,
+                      allowed: Tuple[str, ...] = IMAGE_TYPES) -> UploadedFile:
+    """
+    Declared type -> size hint -> first-chunk signature -> bounded chunked read with incremental SHA-256
+    """
+    check_upload_type(file, allowed)
+    if getattr(file, "size", None) is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large (limit {max_bytes // (1024 * 1024)} MB)")
+
+    data = bytearray()
+    hasher = hashlib.sha256()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        if not data and not _signature_allowed(sniff_upload_type(chunk[:16]), allowed):
+            # Declared type and actual bytes disagree; stop before reading the rest
+            raise HTTPException(status_code=415, detail="File content does not match an accepted type")
+        if len(data) + len(chunk) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large (limit {max_bytes // (1024 * 1024)} MB)")
+        data.extend(chunk)
+        hasher.update(chunk)
+    await file.close()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return UploadedFile(file.filename or "upload", (file.content_type or "").lower(), data, hasher.hexdigest())
+
+
+class UploadTooLarge(Exception):
+    """Raised into the app when a request body grows past UploadLimitMiddleware's limit"""
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that bounds multipart bodies. A Content-Length over the limit gets a 413
+    before the parser runs. Bodies without one (chunked) are counted as they are received; once
+    past the limit the app's receive raises UploadTooLarge and the client gets a 413 instead of
+    whatever the app answers. Paths in path_limits (prefix -> bytes) get their own limit.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES,
+                 path_limits: Optional[dict] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    def _limit(self, path: str) -> int:
+        for prefix, limit in self.path_limits.items():
+            if path.startswith(prefix):
+                return limit
+        return self.max_bytes
+
+    @staticmethod
+    async def _reject(send) -> None:
+        body = b'{"detail":"Upload too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        if not content_type.startswith("multipart/"):
+            await self.app(scope, receive, send)
+            return
+        limit = self._limit(scope.get("path", ""))
+        length = headers.get(b"content-length", b"").decode("latin-1")
+        if length.isdigit() and int(length) > limit:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = started = rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body exceeded {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started, rejected
+            if rejected:
+                # The app's own answer to the aborted body (usually a 400) is replaced by the 413
+                return
+            if exceeded and not started:
+                started = rejected = True
+                await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(send)
@@ -0,0 +1,149 @@
+"""
+Vision payload builder
+Crops, downsizes and re-encodes worksheet images before they are sent to GPT-4o
+"""
+import base64
+import math
+import os
+import cv2
+import numpy as np
+from typing import List, Dict, Any, Tuple, Optional
+from roi_fixer import ROIBoxFixer
+
+# "full": whole page, "section": the "Rechne auf deinem Weg" area, "rois": one crop per problem
+VISION_CROP = os.getenv("MIILA_VISION_CROP", "section").lower()
+VISION_MAX_EDGE = int(os.getenv("MIILA_VISION_MAX_EDGE", "1536"))
+VISION_JPEG_QUALITY = int(os.getenv("MIILA_VISION_JPEG_QUALITY", "85"))
+VISION_DETAIL = os.getenv("MIILA_VISION_DETAIL", "high").lower()
+
+# Fractions (x0, y0, x1, y1) of the page holding the six problems and their working grids
+SECTION_BOUNDS = (0.0, 0.18, 1.0, 0.95)
+
+# Per-problem crops extend the answer box left over the printed problem and down over the grid
+ROI_PAD_LEFT = 1.4    # in answer-box widths
+ROI_PAD_RIGHT = 0.1
+ROI_PAD_UP = 1.0      # in answer-box heights
+ROI_PAD_DOWN = 2.5
+
+
+def sniff_mime(image_bytes: bytes) -> str:
+    """
+    MIME type from the file signature (uploads are not always JPEG)
+    """
+    head = bytes(image_bytes[:12])
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    GPT-4o image token cost: 85 base + 170 per 512px tile after the API's own resizing
+    """
+    if detail == "low" or width <= 0 or height <= 0:
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+class VisionPayloadBuilder:
+    """Builds the image_url parts of the analysis request and reports what they cost"""
+
+    def __init__(self, crop: str = VISION_CROP, max_long_edge: int = VISION_MAX_EDGE,
+                 jpeg_quality: int = VISION_JPEG_QUALITY, detail: str = VISION_DETAIL):
+        self.crop = crop if crop in ("full", "section", "rois") else "full"
+        self.max_long_edge = max(0, max_long_edge)
+        self.jpeg_quality = max(1, min(100, jpeg_quality))
+        self.detail = detail if detail in ("low", "high", "auto") else "high"
+
+    def signature(self) -> str:
+        """
+        Identifies the payload settings (part of the result-cache key)
+        """
+        return f"{self.crop}:{self.max_long_edge}:{self.jpeg_quality}:{self.detail}"
+
+    def crop_regions(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        Pixel regions (x0, y0, x1, y1) to send, in reading order
+        """
+        height, width = image.shape[:2]
+        if self.crop == "section":
+            x0, y0, x1, y1 = SECTION_BOUNDS
+            return [(int(x0 * width), int(y0 * height), int(x1 * width), int(y1 * height))]
+        if self.crop == "rois":
+            regions = []
+            for x, y, w, h in ROIBoxFixer().find_answer_locations_in(image):
+                regions.append((
+                    max(0, int(x - ROI_PAD_LEFT * w)),
+                    max(0, int(y - ROI_PAD_UP * h)),
+                    min(width, int(x + w + ROI_PAD_RIGHT * w)),
+                    min(height, int(y + h + ROI_PAD_DOWN * h)),
+                ))
+            return regions
+        return [(0, 0, width, height)]
+
+    def _downscale(self, image: np.ndarray) -> np.ndarray:
+        height, width = image.shape[:2]
+        long_edge = max(height, width)
+        if not self.max_long_edge or long_edge <= self.max_long_edge:
+            return image
+        scale = self.max_long_edge / long_edge
+        return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    def build(self, image_bytes: bytes, image: Optional[np.ndarray] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Return (image_url content parts, stats). Pass the decoded image to avoid decoding twice.
+        """
+        if image is None:
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        original_tokens = None
+        if image is not None:
+            original_tokens = estimate_image_tokens(image.shape[1], image.shape[0], "high")
+        stats = {
+            "crop": self.crop,
+            "detail": self.detail,
+            "original_bytes": len(image_bytes),
+            "original_tokens_est": original_tokens,
+            "images": 0,
+            "sent_bytes": 0,
+            "sent_tokens_est": 0,
+        }
+
+        parts = []
+        height, width = image.shape[:2] if image is not None else (0, 0)
+        fits = not self.max_long_edge or max(height, width) <= self.max_long_edge
+        if image is None or (self.crop == "full" and fits):
+            # Nothing to crop or shrink: send the original bytes with their real MIME type
+            encoded = bytes(image_bytes)
+            mime = sniff_mime(encoded)
+            parts.append(self._part(encoded, mime))
+            stats["images"] = 1
+            stats["sent_bytes"] = len(encoded)
+            stats["sent_tokens_est"] = estimate_image_tokens(width, height, self.detail) if image is not None else None
+            return parts, stats
+
+        for x0, y0, x1, y1 in self.crop_regions(image):
+            region = self._downscale(image[y0:y1, x0:x1])
+            ok, buf = cv2.imencode(".jpg", region, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            if not ok:
+                continue
+            encoded = buf.tobytes()
+            parts.append(self._part(encoded, "image/jpeg"))
+            stats["images"] += 1
+            stats["sent_bytes"] += len(encoded)
+            stats["sent_tokens_est"] += estimate_image_tokens(region.shape[1], region.shape[0], self.detail)
+        return parts, stats
+
+    def _part(self, encoded: bytes, mime: str) -> Dict[str, Any]:
+        data = base64.b64encode(encoded).decode()
+        return {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{data}", "detail": self.detail}}
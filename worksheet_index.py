@@ -0,0 +1,178 @@
+"""
+Fixed-worksheet index
+Tracks the worksheet to grade (newest image in uploads/fixed, or the configured fixed file)
+with an mtime-polling thread so requests never list the directory or read files, and keeps
+only that worksheet's bytes in memory
+"""
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+FIXED_POLL_SECONDS = float(os.getenv("MIILA_FIXED_POLL_SECONDS", "1.0"))
+WORKSHEET_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+class FixedWorksheet:
+    """Immutable snapshot of one worksheet file"""
+
+    __slots__ = ("path", "data", "mtime", "size")
+
+    def __init__(self, path: str, data: bytes, mtime: float, size: int):
+        self.path = path
+        self.data = data
+        self.mtime = mtime
+        self.size = size
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.path)[1].lower() or ".png"
+
+
+class FixedWorksheetIndex:
+    """
+    Newest (or pinned) worksheet of a directory. The poller stats the candidates and reads only
+    the selected file, once per version; requests just pick up the snapshot it loaded.
+    """
+
+    def __init__(self, directory: str, fixed_file: Optional[str] = None, pin_first: bool = False,
+                 poll_interval: float = FIXED_POLL_SECONDS):
+        self.directory = directory
+        # A configured file wins; it may be a bare filename inside the directory or an absolute path
+        self.fixed_path = None
+        if fixed_file:
+            self.fixed_path = fixed_file if os.path.isabs(fixed_file) else os.path.join(directory, fixed_file)
+        # ALWAYS_USE_FIXED without a file: keep grading the first worksheet found, ignore later drops
+        self.pin_first = pin_first
+        self.poll_interval = max(0.1, poll_interval)
+        self._lock = threading.Lock()
+        # Serializes refreshes (poller thread vs. an explicit refresh()) so a version is read once
+        self._refresh_lock = threading.Lock()
+        # (path, mtime, size) of the worksheet to grade, and its loaded bytes
+        self._selected: Optional[Tuple[str, float, int]] = None
+        self._current: Optional[FixedWorksheet] = None
+        self._files: Dict[str, Tuple[float, int]] = {}
+        self._listeners: List[Callable[[str, float], None]] = []
+        self._refreshed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reads = 0
+
+    def add_listener(self, callback: Callable[[str, float], None]) -> None:
+        """
+        callback(path, mtime) runs on the poller thread for every new or modified worksheet file,
+        after the selected worksheet has been reloaded (current() already returns the new version).
+        """
+        self._listeners.append(callback)
+
+    def current(self) -> Optional[FixedWorksheet]:
+        """
+        The worksheet to grade, or None. Never touches the disk once the index has been started;
+        the poller thread loads new versions.
+        """
+        if not self._refreshed:
+            self.refresh()
+        with self._lock:
+            return self._current
+
+    def _scan(self) -> Dict[str, Tuple[float, int]]:
+        files: Dict[str, Tuple[float, int]] = {}
+        if self.fixed_path:
+            try:
+                st = os.stat(self.fixed_path)
+                files[self.fixed_path] = (st.st_mtime, st.st_size)
+            except OSError:
+                pass
+            return files
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith(WORKSHEET_EXTENSIONS) or not entry.is_file():
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files[entry.path] = (st.st_mtime, st.st_size)
+        except OSError:
+            pass
+        return files
+
+    @staticmethod
+    def _read(path: str, mtime: float, size: int) -> Optional[FixedWorksheet]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return FixedWorksheet(path, data, mtime, size)
+
+    def refresh(self) -> None:
+        """
+        One poll: stat the candidates, load the selected worksheet if it changed, then notify
+        listeners about changed files
+        """
+        with self._refresh_lock:
+            files = self._scan()
+            with self._lock:
+                changed = [p for p, sig in files.items() if self._files.get(p) != sig]
+                selected = self._selected
+                current = self._current
+            if not files:
+                target = None
+            elif self.pin_first and selected is not None and selected[0] in files:
+                target = selected[0]
+            else:
+                target = max(files, key=lambda p: files[p][0])
+            target_sig = (target, *files[target]) if target is not None else None
+
+            snapshot = current
+            if target_sig is None:
+                snapshot = None
+            elif current is None or (current.path, current.mtime, current.size) != target_sig:
+                # Read off the request path; a failed read leaves nothing loaded and is retried next poll
+                snapshot = self._read(*target_sig)
+                with self._lock:
+                    self.reads += 1
+
+            with self._lock:
+                self._files = files
+                self._selected = target_sig
+                self._current = snapshot
+                self._refreshed = True
+
+        for path in changed:
+            for callback in self._listeners:
+                try:
+                    callback(path, files[path][0])
+                except Exception as e:
+                    print(f"Worksheet listener failed for {os.path.basename(path)}: {e}")
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+        if self._thread is not None:
+            return
+
+        def _run():
+            while not self._stop.wait(self.poll_interval):
+                self.refresh()
+
+        self._thread = threading.Thread(target=_run, name="miila-fixed-index", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            selected, current = self._selected, self._current
+            return {
+                "directory": self.directory,
+                "fixed_file": self.fixed_path,
+                "pinned": self.pin_first,
+                "candidates": len(self._files),
+                "current": os.path.basename(selected[0]) if selected else None,
+                "current_bytes": selected[2] if selected else 0,
+                "loaded": current is not None,
+                "reads": self.reads,
+            }